@@ -0,0 +1,4 @@
+# encoding: utf-8
+from pymarc2.cli import main
+
+main()
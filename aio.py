@@ -0,0 +1,184 @@
+# encoding: utf-8
+"""
+asyncio reader and writer
+
+Records are framed on the event loop using the length prefix; decoding, and
+encoding of records still undecoded, run in an executor, at most
+max_pending records at a time, so a slow consumer stops reading from the
+stream instead of buffering it. A record is returned as soon as it is
+decoded; the records behind it are framed in the background, never waited
+for.
+Needs trollius, the asyncio port for python 2.
+"""
+from collections import deque
+
+try:
+    import trollius as asyncio
+    from trollius import From, Return
+except ImportError:
+    raise ImportError('pymarc2 asyncio support requires the trollius package')
+
+import exc
+from record import Record
+from writer import encode_records
+
+
+def _decode(record_cls, raw, raw_encoding):
+    record = record_cls(raw, raw_encoding)
+    record._load()
+    return record
+
+
+def _encode_raw(record_cls, raw, raw_encoding, to_encoding):
+    return encode_records([record_cls(raw, raw_encoding)], to_encoding)
+
+
+class AsyncReader(object):
+    def __init__(self, record_cls, stream, raw_encoding='utf-8', executor=None, max_pending=8, loop=None):
+        """
+        record_cls - record class
+        stream - asyncio.StreamReader with ISO 2709 records
+        raw_encoding - encoding of raw records
+        executor - executor used for decoding, the loop default if None
+        max_pending - number of records read ahead and decoded concurrently
+        """
+        self._record_cls = record_cls
+        self._stream = stream
+        self._raw_encoding = raw_encoding
+        self._executor = executor
+        self._max_pending = max_pending
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = deque()
+        self._eof = False
+        self._error = None
+        # background task framing records into _pending
+        self._framing = None
+        # future read() waits on while _pending is empty
+        self._waiter = None
+
+    @asyncio.coroutine
+    def read_raw(self):
+        """
+        returns the next raw record, or None at the end of the stream;
+        not to be mixed with read(), which frames records in the background
+        """
+        try:
+            first5 = yield From(self._stream.readexactly(5))
+        except asyncio.IncompleteReadError as e:
+            if e.partial:
+                raise exc.RecordLengthInvalid
+            raise Return(None)
+
+        if not first5.isdigit() or int(first5) <= 5:
+            raise exc.RecordLengthInvalid
+        try:
+            rest = yield From(self._stream.readexactly(int(first5) - 5))
+        except asyncio.IncompleteReadError:
+            raise exc.RecordLengthInvalid
+        raise Return(first5 + rest)
+
+    def _wake(self):
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.set_result(None)
+
+    def _start_framing(self):
+        if self._framing is None and not self._eof and self._error is None and \
+                len(self._pending) < self._max_pending:
+            self._framing = asyncio.async(self._frame(), loop=self._loop)
+
+    @asyncio.coroutine
+    def _frame(self):
+        try:
+            while len(self._pending) < self._max_pending:
+                raw = yield From(self.read_raw())
+                if raw is None:
+                    self._eof = True
+                    break
+                self._pending.append(self._loop.run_in_executor(
+                    self._executor, _decode, self._record_cls, raw, self._raw_encoding))
+                self._wake()
+        except Exception as e:
+            self._error = e
+        finally:
+            self._framing = None
+            self._wake()
+
+    @asyncio.coroutine
+    def read(self):
+        """
+        returns the next decoded record, or None at the end of the stream
+        """
+        while not self._pending:
+            if self._error is not None:
+                raise self._error
+            if self._eof:
+                raise Return(None)
+            self._start_framing()
+            self._waiter = asyncio.Future(loop=self._loop)
+            yield From(self._waiter)
+            self._waiter = None
+
+        record = yield From(self._pending.popleft())
+        self._start_framing()
+        raise Return(record)
+
+
+class AsyncWriter(object):
+    def __init__(self, stream, to_encoding='utf-8', executor=None, max_pending=8, loop=None):
+        """
+        stream - asyncio.StreamWriter
+        to_encoding - encoding of written records
+        executor - executor used for encoding, the loop default if None
+        max_pending - number of records encoded concurrently before write
+            waits for the stream to drain
+        """
+        self._stream = stream
+        self._to_encoding = to_encoding
+        self._executor = executor
+        self._max_pending = max_pending
+        self._loop = loop or asyncio.get_event_loop()
+        self._pending = deque()
+
+    @asyncio.coroutine
+    def write(self, record):
+        """
+        queues record for writing; what is written is the record as it is
+        when write is called, it may be changed or reused afterwards. An
+        undecoded record is encoded in the executor from its raw buffer, a
+        decoded one is encoded here, without modifying it, since its fields
+        can change as soon as write returns
+        """
+        if self._stream is None:
+            raise exc.NoActiveFile
+        if not isinstance(record, Record):
+            raise exc.WriteNeedsRecord
+
+        if record.raw:
+            data = self._loop.run_in_executor(self._executor, _encode_raw, type(record), record.raw,
+                                              record.raw_encoding, self._to_encoding)
+        else:
+            data = asyncio.Future(loop=self._loop)
+            data.set_result(encode_records([record], self._to_encoding))
+        self._pending.append(data)
+        if len(self._pending) >= self._max_pending:
+            yield From(self._write_pending(1))
+
+    @asyncio.coroutine
+    def _write_pending(self, count):
+        while count and self._pending:
+            data = yield From(self._pending.popleft())
+            self._stream.write(data)
+            count -= 1
+        yield From(self._stream.drain())
+
+    @asyncio.coroutine
+    def flush(self):
+        yield From(self._write_pending(len(self._pending)))
+
+    @asyncio.coroutine
+    def close(self):
+        if self._stream is None:
+            return
+        yield From(self.flush())
+        self._stream.close()
+        self._stream = None
@@ -0,0 +1,239 @@
+# encoding: utf-8
+"""
+benchmark suite
+
+Generates reproducible synthetic MARC21 or UNIMARC corpora and measures the
+main code paths in records/sec and MB/sec:
+
+    python bench.py --flavour unimarc --records 20000 --linked 3 --save base.json
+    python bench.py --flavour unimarc --records 20000 --linked 3 --compare base.json
+"""
+import json
+import random
+import sys
+from StringIO import StringIO
+from time import time
+
+from constants import LEADER_LEN, SUBFIELD_INDICATOR, END_OF_FIELD, END_OF_RECORD
+from marc8 import marc8_to_unicode
+from reader import Reader
+from record import Record, UnimarcRecord
+
+try:
+    from lxml import etree as ET
+    import marcxml
+except ImportError:
+    ET = None
+
+
+LATIN_WORDS = ('library', 'catalogue', 'history', 'science', 'journal', 'annual', 'report',
+               'studies', 'national', 'archive', 'collection', 'review', 'modern', 'theory')
+CYRILLIC_WORDS = (u'библиотека', u'история', u'наука', u'журнал', u'сборник', u'труды',
+                  u'отчет', u'материалы', u'словарь', u'исследования')
+# MARC-8 words, ANSEL combining diacritics precede the base letter
+MARC8_WORDS = ('caf\xe2e', 'na\xe8ive', 'M\xe8uller', 'cr\xe3eme', 'se\xf0nor', '\xe1a la')
+
+
+class CorpusGenerator(object):
+    def __init__(self, flavour='marc21', charset='utf-8', fields=20, subfields=3, linked=0, seed=0):
+        """
+        flavour - 'marc21' or 'unimarc'
+        charset - 'utf-8' or 'marc8' content
+        fields - data fields per record
+        subfields - subfields per data field
+        linked - 4xx fields with $1 linked entries per record (unimarc only)
+        seed - random seed, the same arguments always give the same corpus
+        """
+        self.flavour = flavour
+        self.charset = charset
+        self.fields = fields
+        self.subfields = subfields
+        self.linked = linked
+        self.seed = seed
+        if charset == 'marc8':
+            self.words = LATIN_WORDS + MARC8_WORDS
+        elif flavour == 'unimarc':
+            self.words = LATIN_WORDS + tuple(w.encode('utf-8') for w in CYRILLIC_WORDS)
+        else:
+            self.words = LATIN_WORDS
+
+    @property
+    def record_cls(self):
+        return UnimarcRecord if self.flavour == 'unimarc' else Record
+
+    @property
+    def raw_encoding(self):
+        return self.charset
+
+    def _text(self, rnd, words=4):
+        return ' '.join(rnd.choice(self.words) for i in xrange(rnd.randint(1, words)))
+
+    def _subfields(self, rnd, codes='abcdefg'):
+        return ''.join(SUBFIELD_INDICATOR + codes[i % len(codes)] + self._text(rnd)
+                       for i in xrange(self.subfields))
+
+    def record(self, number):
+        # an integer seed; a string would go through hash(), which differs
+        # between builds and with PYTHONHASHSEED
+        rnd = random.Random(self.seed * 1000003 + number)
+        if self.flavour == 'unimarc':
+            fields = [('001', 'RU\\NLR\\%09d' % number), ('005', '20120222101010.0'),
+                      ('100', '  ' + SUBFIELD_INDICATOR + 'a20120222d2012    k  y0rusy50      ca')]
+            tags = ('010', '101', '200', '210', '215', '300', '606', '700', '701')
+            for i in xrange(self.linked):
+                fields.append(('461', '  ' + SUBFIELD_INDICATOR + '1001RU\\NLR\\%09d' % rnd.randint(0, number) +
+                               SUBFIELD_INDICATOR + '12001 ' + self._subfields(rnd)))
+        else:
+            fields = [('001', '%09d' % number), ('005', '20120222101010.0'),
+                      ('008', '120222s2012    xxu           000 0 eng d')]
+            tags = ('020', '100', '245', '260', '300', '500', '650', '650', '700')
+
+        for i in xrange(self.fields):
+            fields.append((tags[i % len(tags)], rnd.choice('01 ') + ' ' + self._subfields(rnd)))
+        fields.sort(key=lambda f: f[0])
+
+        leader = '00000nam  2200000   4500'
+        if self.charset != 'marc8':
+            leader = leader[:9] + 'a' + leader[10:]
+        return pack_record(leader, fields)
+
+    def corpus(self, count):
+        return ''.join(self.record(i) for i in xrange(count))
+
+
+def pack_record(leader, fields):
+    """
+    leader - 24 character leader, length and base address are filled in
+    fields - list of (tag, raw field data without END_OF_FIELD)
+    """
+    directory = []
+    data = []
+    offset = 0
+    for tag, field_data in fields:
+        field_data += END_OF_FIELD
+        directory.append('%s%04d%05d' % (tag, len(field_data), offset))
+        data.append(field_data)
+        offset += len(field_data)
+    directory.append(END_OF_FIELD)
+    data.append(END_OF_RECORD)
+    directory = ''.join(directory)
+    data = ''.join(data)
+    base_address = LEADER_LEN + len(directory)
+    return '%05d%s%05d%s' % (base_address + len(data), leader[5:12], base_address, leader[17:]) + directory + data
+
+
+def _timed(func, repeat):
+    best = None
+    for i in xrange(repeat):
+        start = time()
+        func()
+        elapsed = time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run(generator, count, repeat=3):
+    """
+    returns {benchmark name: {'seconds', 'records_per_sec', 'mb_per_sec'}}
+    """
+    corpus = generator.corpus(count)
+    record_cls = generator.record_cls
+    encoding = generator.raw_encoding
+    reader = Reader(record_cls, StringIO(corpus))
+    raws = [reader[i].raw for i in xrange(count)]
+
+    def decoded():
+        records = [record_cls(raw, encoding) for raw in raws]
+        for record in records:
+            record._load()
+        return records
+
+    records = decoded()
+
+    benchmarks = [
+        ('reader_index', lambda: len(Reader(record_cls, StringIO(corpus)))),
+        ('decode', decoded),
+        ('as_marc', lambda: [record.as_marc() for record in records]),
+        ('to_dict', lambda: [record.to_dict() for record in records]),
+    ]
+
+    if encoding == 'marc8':
+        field_data = []
+        for raw in raws:
+            base_address = int(raw[12:17])
+            field_data.extend(raw[base_address:-1].split(END_OF_FIELD))
+        benchmarks.append(('marc8_translate', lambda: [marc8_to_unicode(data) for data in field_data]))
+
+    # only the serializers meant for the flavour; marc_xml cannot write
+    # UNIMARC linked fields
+    if ET is not None and record_cls is UnimarcRecord:
+        benchmarks.append(('unimarc_xml', lambda: [ET.tostring(marcxml.record_to_unimarc_xml(r)) for r in records]))
+        benchmarks.append(('rustam_xml', lambda: [ET.tostring(marcxml.record_to_rustam_xml(r)) for r in records]))
+    elif ET is not None:
+        benchmarks.append(('marc_xml', lambda: [ET.tostring(marcxml.record_to_marc_xml(r)) for r in records]))
+
+    megabytes = len(corpus) / (1024.0 * 1024.0)
+    results = {}
+    for name, func in benchmarks:
+        seconds = _timed(func, repeat)
+        results[name] = {
+            'seconds': seconds,
+            'records_per_sec': count / seconds if seconds else 0.0,
+            'mb_per_sec': megabytes / seconds if seconds else 0.0,
+        }
+    return results
+
+
+def compare(results, baseline):
+    """
+    returns lines comparing records/sec against a saved baseline
+    """
+    lines = []
+    for name in sorted(results.iterkeys()):
+        if name not in baseline:
+            continue
+        old = baseline[name]['records_per_sec']
+        new = results[name]['records_per_sec']
+        lines.append('%-16s %12.0f %12.0f %+7.1f%%' % (name, old, new, (new / old - 1) * 100 if old else 0.0))
+    return lines
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='pymarc2 benchmarks')
+    parser.add_argument('--flavour', choices=('marc21', 'unimarc'), default='marc21')
+    parser.add_argument('--charset', choices=('utf-8', 'marc8'), default='utf-8')
+    parser.add_argument('--records', type=int, default=10000)
+    parser.add_argument('--fields', type=int, default=20)
+    parser.add_argument('--subfields', type=int, default=3)
+    parser.add_argument('--linked', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--save', help='write results as json')
+    parser.add_argument('--compare', help='compare with results saved by --save')
+    args = parser.parse_args(argv)
+
+    generator = CorpusGenerator(args.flavour, args.charset, args.fields, args.subfields, args.linked, args.seed)
+    results = run(generator, args.records, args.repeat)
+
+    for name in sorted(results.iterkeys()):
+        result = results[name]
+        print '%-16s %12.0f rec/s %8.2f MB/s' % (name, result['records_per_sec'], result['mb_per_sec'])
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        print
+        print '%-16s %12s %12s %8s' % ('benchmark', 'baseline', 'current', 'change')
+        for line in compare(results, baseline):
+            print line
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'params': vars(args), 'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
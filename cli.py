@@ -0,0 +1,293 @@
+# encoding: utf-8
+"""
+command line tool
+
+    python -m pymarc2 count dump.mrc
+    python -m pymarc2 convert dump.mrc dump.xml --to unimarc --workers 4
+    python -m pymarc2 filter - - --match '200$a=^History' < in.mrc > out.mrc
+    python -m pymarc2 split dump.mrc part- --size 10000
+    python -m pymarc2 index dump.mrc dump.mrc.idx
+    python -m pymarc2 index dump.mrc --update
+    python -m pymarc2 validate dump.mrc report.tsv --rules rusmarc --workers 4
+
+'-' reads stdin or writes stdout; records are then framed as a stream and
+the input never needs to be seekable.
+"""
+import argparse
+import os
+import re
+import sys
+from time import time
+
+from iso2709 import iter_fields, iter_subfields
+from marc8 import decode_data
+from pipeline import convert_raw_to_xml
+from reader import Reader, iter_stream
+from record import Record, UnimarcRecord
+from validation import RuleSet, MARC21_RULES, RUSMARC_RULES, validate_raws, write_report
+from writer import Writer
+
+RECORD_CLASSES = {
+    'marc21': Record,
+    'unimarc': UnimarcRecord,
+}
+
+RULE_SETS = {
+    'marc21': MARC21_RULES,
+    'rusmarc': RUSMARC_RULES,
+}
+
+
+class Progress(object):
+    def __init__(self, enabled, every=10000):
+        self.enabled = enabled
+        self.every = every
+        self.start = time()
+        self.next = every
+        self.records = self.nbytes = 0
+
+    def __call__(self, records, nbytes):
+        self.records = records
+        self.nbytes = nbytes
+        if self.enabled and records >= self.next:
+            self.next = records + self.every
+            self.report()
+
+    def finish(self):
+        if self.enabled:
+            self.report()
+
+    def report(self):
+        records = self.records
+        nbytes = self.nbytes
+        elapsed = (time() - self.start) or 1e-9
+        sys.stderr.write('%d records, %.0f rec/s, %.2f MB/s\n' %
+                         (records, records / elapsed, nbytes / elapsed / (1024.0 * 1024.0)))
+
+
+def _raws(args):
+    if args.input == '-':
+        if args.recover:
+            raise SystemExit('--recover needs a seekable input file')
+        return iter_stream(sys.stdin)
+    return _reader(args).iter_raw()
+
+
+def _reader(args):
+    return Reader(RECORD_CLASSES[args.flavour], args.input, args.encoding, recover=args.recover)
+
+
+def _output(path, mode='wb'):
+    if path == '-':
+        return sys.stdout
+    return open(path, mode)
+
+
+def _close(out):
+    if out is sys.stdout:
+        out.flush()
+    else:
+        out.close()
+
+
+def _copy(raws, out, progress, keep=None):
+    records = nbytes = 0
+    for raw in raws:
+        if keep is None or keep(raw):
+            out.write(raw)
+            records += 1
+            nbytes += len(raw)
+            progress(records, nbytes)
+    progress.finish()
+    return records
+
+
+def parse_match(expression):
+    """
+    'TAG$CODE=REGEX' or 'TAG=REGEX' -> (tag, code or None, compiled regex)
+    """
+    path, pattern = expression.split('=', 1)
+    tag, sep, code = path.partition('$')
+    return tag, code or None, re.compile(pattern.decode('utf-8'), re.UNICODE)
+
+
+def record_filter(tags, matches, encoding, invert=False):
+    """
+    returns a predicate on raw records; only fields with the requested tags
+    are looked at and only matched subfields are decoded
+    """
+    wanted = set(tags) | set(tag for tag, code, regex in matches)
+
+    def keep(raw):
+        present = set()
+        matched = set()
+        for tag, data in iter_fields(raw, wanted):
+            present.add(tag)
+            for i, (match_tag, code, regex) in enumerate(matches):
+                if i in matched or match_tag != tag:
+                    continue
+                if code is None:
+                    values = [data]
+                else:
+                    values = [value for sub_code, value in iter_subfields(data) if sub_code == code]
+                for value in values:
+                    if regex.search(decode_data(value, encoding, 'replace')):
+                        matched.add(i)
+                        break
+        result = all(tag in present for tag in tags) and len(matched) == len(matches)
+        return result != invert
+
+    return keep
+
+
+def cmd_count(args):
+    if args.input == '-':
+        print sum(1 for raw in iter_stream(sys.stdin))
+    else:
+        print len(_reader(args))
+
+
+def cmd_convert(args):
+    to = args.to or ('unimarc' if args.flavour == 'unimarc' else 'marcxml')
+    if to == 'marcxml' and args.flavour == 'unimarc':
+        # MARCXML has no place for the fields embedded in 4xx $1
+        raise SystemExit('UNIMARC records cannot be written as marcxml, use --to unimarc')
+    if to == 'marc' and args.workers is not None:
+        raise SystemExit('--workers applies to xml output only')
+
+    progress = Progress(args.progress)
+    raws = _raws(args)
+    out = _output(args.output)
+    record_cls = RECORD_CLASSES[args.flavour]
+
+    if to == 'marc':
+        writer = Writer(out, to_encoding=args.to_encoding)
+        records = nbytes = 0
+        for raw in raws:
+            writer.write(record_cls(raw, args.encoding))
+            records += 1
+            nbytes += len(raw)
+            progress(records, nbytes)
+        writer.flush()
+        progress.finish()
+    else:
+        convert_raw_to_xml(raws, record_cls, args.encoding, out, xml_format=to,
+                           processes=args.workers, chunk_size=args.chunk_size, progress=progress)
+        progress.finish()
+    _close(out)
+
+
+def cmd_filter(args):
+    matches = [parse_match(expression) for expression in args.match]
+    keep = record_filter(args.tag, matches, args.encoding, args.invert)
+    raws = _raws(args)
+    out = _output(args.output)
+    _copy(raws, out, Progress(args.progress), keep)
+    _close(out)
+
+
+def cmd_split(args):
+    out = None
+    part = 0
+    in_part = 0
+    progress = Progress(args.progress)
+    records = nbytes = 0
+    for raw in _raws(args):
+        if out is None or in_part == args.size:
+            if out is not None:
+                out.close()
+            part += 1
+            in_part = 0
+            out = open('%s%04d.mrc' % (args.prefix, part), 'wb')
+        out.write(raw)
+        in_part += 1
+        records += 1
+        nbytes += len(raw)
+        progress(records, nbytes)
+    if out is not None:
+        out.close()
+    progress.finish()
+
+
+def cmd_index(args):
+    if args.input == '-':
+        raise SystemExit('index needs a seekable input file')
+    path = args.output or args.input + '.idx'
+    reader = _reader(args)
+    if args.update and os.path.exists(path):
+        with open(path) as index_file:
+            reader.load_index(index_file)
+    reader.build_index(args.workers)
+    out = _output(path, 'w')
+    reader.save_index(out)
+    _close(out)
+
+
+def cmd_validate(args):
+    rules = RuleSet(RULE_SETS[args.rules or ('marc21' if args.flavour == 'marc21' else 'rusmarc')])
+    out = _output(args.output, 'w')
+    count = write_report(validate_raws(_raws(args), rules, args.workers, args.chunk_size), out)
+    _close(out)
+    if count:
+        raise SystemExit(1)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='pymarc2')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('input', help="input file, '-' for stdin")
+    common.add_argument('--flavour', choices=sorted(RECORD_CLASSES), default='unimarc')
+    common.add_argument('--encoding', default='utf-8', help='encoding of input records')
+    common.add_argument('--recover', action='store_true', help='skip damaged records')
+    common.add_argument('--progress', action='store_true', help='report throughput on stderr')
+    commands = parser.add_subparsers()
+
+    count = commands.add_parser('count', parents=[common], help='count records')
+    count.set_defaults(func=cmd_count)
+
+    convert = commands.add_parser('convert', parents=[common], help='convert records')
+    convert.add_argument('output', help="output file, '-' for stdout")
+    convert.add_argument('--to', choices=('marc', 'marcxml', 'unimarc', 'rustam'),
+                         help='output format, unimarc xml for --flavour unimarc and marcxml otherwise')
+    convert.add_argument('--to-encoding', default='utf-8', help='encoding of written iso 2709 records')
+    convert.add_argument('--workers', type=int, default=None, help='xml worker processes')
+    convert.add_argument('--chunk-size', type=int, default=100)
+    convert.set_defaults(func=cmd_convert)
+
+    filter_ = commands.add_parser('filter', parents=[common], help='copy matching records unchanged')
+    filter_.add_argument('output', help="output file, '-' for stdout")
+    filter_.add_argument('--tag', action='append', default=[], help='record must have this tag')
+    filter_.add_argument('--match', action='append', default=[], metavar='TAG[$CODE]=REGEX',
+                         help='field or subfield must match regex')
+    filter_.add_argument('--invert', action='store_true', help='copy records that do not match')
+    filter_.set_defaults(func=cmd_filter)
+
+    split = commands.add_parser('split', parents=[common], help='split into files of --size records')
+    split.add_argument('prefix', help='output files are PREFIX0001.mrc, PREFIX0002.mrc, ...')
+    split.add_argument('--size', type=int, default=10000)
+    split.set_defaults(func=cmd_split)
+
+    index = commands.add_parser('index', parents=[common], help='write the record offset index')
+    index.add_argument('output', nargs='?', help='index file, INPUT.idx by default')
+    index.add_argument('--update', action='store_true',
+                       help='extend an existing index with records appended since it was written')
+    index.add_argument('--workers', type=int, default=None, help='index worker processes')
+    index.set_defaults(func=cmd_index)
+
+    validate = commands.add_parser('validate', parents=[common], help='check records against structure rules')
+    validate.add_argument('output', nargs='?', default='-', help="report file, '-' for stdout")
+    validate.add_argument('--rules', choices=sorted(RULE_SETS), help='rule set, by flavour if not given')
+    validate.add_argument('--workers', type=int, default=1, help='validation worker processes')
+    validate.add_argument('--chunk-size', type=int, default=1000)
+    validate.set_defaults(func=cmd_validate)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
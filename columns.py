@@ -0,0 +1,89 @@
+# encoding: utf-8
+"""
+columnar extraction of selected fields
+
+    columns = extract_columns(Reader(UnimarcRecord, 'dump.mrc'), ['001', '200$a', '700$a'])
+    write_csv(columns, open('dump.csv', 'wb'))
+
+One pass over the raw records; only the fields of the requested tags are
+located and only the requested subfields decoded. Each column holds one
+unicode value per record, repeated values joined by separator and missing
+ones empty. NumPy and pyarrow are optional and only needed by the
+corresponding converters.
+"""
+import csv
+from collections import OrderedDict
+
+from iso2709 import iter_fields, iter_subfields
+from marc8 import decode_data
+
+
+def parse_path(path):
+    """
+    '200$a' -> ('200', 'a'), '001' -> ('001', None)
+    """
+    tag, sep, code = path.partition('$')
+    return tag, code or None
+
+
+def extract_columns(reader, paths, separator=u'|'):
+    """
+    reader - Reader
+    paths - 'TAG' for whole fields (control field data) or 'TAG$CODE'
+    returns OrderedDict path -> list of values, one per record
+    """
+    parsed = [(path, ) + parse_path(path) for path in paths]
+    tags = frozenset(tag for path, tag, code in parsed)
+    columns = OrderedDict((path, []) for path in paths)
+    raw_encoding = reader.raw_encoding
+
+    for raw in reader.iter_raw():
+        values = dict((path, []) for path in paths)
+        for tag, data in iter_fields(raw, tags):
+            subfields = None
+            for path, path_tag, code in parsed:
+                if path_tag != tag:
+                    continue
+                if code is None:
+                    values[path].append(data)
+                    continue
+                if subfields is None:
+                    subfields = list(iter_subfields(data))
+                values[path].extend(value for sub_code, value in subfields if sub_code == code)
+
+        for path in paths:
+            columns[path].append(separator.join(decode_data(value, raw_encoding, 'replace')
+                                                for value in values[path]))
+    return columns
+
+
+def write_csv(columns, out):
+    """
+    writes columns as utf-8 csv with a header row of paths
+    """
+    writer = csv.writer(out)
+    writer.writerow(columns.keys())
+    for row in zip(*columns.values()):
+        writer.writerow([value.encode('utf-8') for value in row])
+
+
+def to_numpy(columns):
+    """
+    returns OrderedDict path -> numpy unicode array
+    """
+    import numpy
+    return OrderedDict((path, numpy.array(values, dtype=unicode)) for path, values in columns.iteritems())
+
+
+def to_arrow(columns):
+    """
+    returns a pyarrow Table with one string column per path
+    """
+    import pyarrow
+    return pyarrow.Table.from_arrays([pyarrow.array(values, type=pyarrow.string()) for values in columns.values()],
+                                     names=list(columns.keys()))
+
+
+def write_parquet(columns, path):
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(to_arrow(columns), path)
@@ -0,0 +1,279 @@
+# encoding: utf-8
+"""
+compressed sources for Reader
+
+gzip and bzip2 files are opened with the standard library, zstandard files
+need the optional zstandard package. BGZF files (gzip members of at most
+64 KiB carrying their compressed size in the 'BC' extra subfield, as produced
+by bgzip or BgzfWriter) get a block index, so seeking to a record offset
+decompresses a single block and large reads can be inflated in parallel.
+"""
+import bz2
+import gzip
+import struct
+import zlib
+from bisect import bisect_right
+from multiprocessing import Pool
+
+GZIP_MAGIC = '\x1f\x8b'
+BZIP2_MAGIC = 'BZh'
+ZSTD_MAGIC = '\x28\xb5\x2f\xfd'
+
+BGZF_HEADER_LEN = 18
+BGZF_MAX_BLOCK_DATA = 0xff00
+BGZF_EOF = ('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43'
+            '\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00')
+
+
+def _is_bgzf(header):
+    return (len(header) == BGZF_HEADER_LEN and header[0:4] == '\x1f\x8b\x08\x04' and
+            header[12:16] == 'BC\x02\x00')
+
+
+def _inflate(cdata):
+    return zlib.decompress(cdata, -15)
+
+
+def _deflate(args):
+    data, level = args
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack('<4BI2BH2BHH', 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2,
+                         len(cdata) + BGZF_HEADER_LEN + 8 - 1)
+    return header + cdata + struct.pack('<II', zlib.crc32(data) & 0xffffffff, len(data))
+
+
+def open_source(path, processes=None):
+    """
+    opens path for Reader, choosing the decompressor by the magic bytes
+    processes - worker processes used by BgzfFile for large reads
+    """
+    with open(path, 'rb') as f:
+        header = f.read(BGZF_HEADER_LEN)
+
+    if _is_bgzf(header):
+        return BgzfFile(path, processes=processes)
+    if header.startswith(GZIP_MAGIC):
+        return gzip.GzipFile(path, 'rb')
+    if header.startswith(BZIP2_MAGIC):
+        return bz2.BZ2File(path, 'rb')
+    if header.startswith(ZSTD_MAGIC):
+        return ZstdFile(path)
+    return open(path, 'rb')
+
+
+class BgzfFile(object):
+    def __init__(self, path, processes=None):
+        """
+        path - BGZF file
+        processes - if set, reads spanning several blocks are inflated by a
+            pool of this many processes
+        """
+        self.name = path
+        self._file = open(path, 'rb')
+        self._processes = processes
+        self._pool = None
+        self._coffsets = []  # compressed offset of each block
+        self._csizes = []
+        self._ustarts = []  # uncompressed offset of each block
+        self._size = 0
+        self._pos = 0
+        self._cached = (-1, '')
+        self._index_blocks()
+
+    def _index_blocks(self):
+        coffset = 0
+        while True:
+            self._file.seek(coffset)
+            header = self._file.read(BGZF_HEADER_LEN)
+            if not header:
+                break
+            if not _is_bgzf(header):
+                raise IOError('%s is not a BGZF file at offset %d' % (self.name, coffset))
+            csize = struct.unpack('<H', header[16:18])[0] + 1
+            self._file.seek(coffset + csize - 4)
+            footer = self._file.read(4)
+            if len(footer) != 4:
+                raise IOError('%s is truncated in the BGZF block at offset %d' % (self.name, coffset))
+            usize = struct.unpack('<I', footer)[0]
+            if usize:
+                self._coffsets.append(coffset)
+                self._csizes.append(csize)
+                self._ustarts.append(self._size)
+                self._size += usize
+            coffset += csize
+
+    def _cdata(self, block):
+        self._file.seek(self._coffsets[block] + BGZF_HEADER_LEN)
+        return self._file.read(self._csizes[block] - BGZF_HEADER_LEN - 8)
+
+    def _block(self, block):
+        if self._cached[0] != block:
+            self._cached = (block, _inflate(self._cdata(block)))
+        return self._cached[1]
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = max(0, min(offset, self._size))
+
+    def tell(self):
+        return self._pos
+
+    def read(self, size=-1):
+        if size < 0 or self._pos + size > self._size:
+            size = self._size - self._pos
+        if size <= 0:
+            return ''
+
+        first = bisect_right(self._ustarts, self._pos) - 1
+        last = bisect_right(self._ustarts, self._pos + size - 1) - 1
+
+        if self._processes and last - first > 1:
+            if self._pool is None:
+                self._pool = Pool(self._processes)
+            blocks = self._pool.map(_inflate, [self._cdata(i) for i in xrange(first, last + 1)])
+            self._cached = (last, blocks[-1])
+        else:
+            blocks = [self._block(i) for i in xrange(first, last + 1)]
+
+        data = ''.join(blocks)
+        start = self._pos - self._ustarts[first]
+        self._pos += size
+        return data[start:start + size]
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class BgzfWriter(object):
+    def __init__(self, fileobj, level=6, processes=None):
+        """
+        fileobj - binary file or path to write BGZF blocks to; close()
+            closes a file it opened itself and flushes one it was given
+        processes - compress blocks with a pool of this many processes
+        """
+        self._owns_file = isinstance(fileobj, basestring)
+        self._file = open(fileobj, 'wb') if self._owns_file else fileobj
+        self._level = level
+        self._buffer = []
+        self._buffered = 0
+        self._pool = Pool(processes) if processes else None
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        # with a pool keep enough blocks around to feed every worker
+        if self._buffered >= BGZF_MAX_BLOCK_DATA * (64 if self._pool else 1):
+            self._flush_blocks(final=False)
+
+    def _flush_blocks(self, final):
+        data = ''.join(self._buffer)
+        chunks = []
+        pos = 0
+        while len(data) - pos >= BGZF_MAX_BLOCK_DATA or (final and pos < len(data)):
+            chunks.append((data[pos:pos + BGZF_MAX_BLOCK_DATA], self._level))
+            pos += BGZF_MAX_BLOCK_DATA
+        rest = data[pos:]
+        self._buffer = [rest] if rest else []
+        self._buffered = len(rest)
+
+        if self._pool is not None:
+            blocks = self._pool.imap(_deflate, chunks)
+        else:
+            blocks = (_deflate(chunk) for chunk in chunks)
+        for block in blocks:
+            self._file.write(block)
+
+    def close(self):
+        if self._file is None:
+            return
+        self._flush_blocks(final=True)
+        self._file.write(BGZF_EOF)
+        if self._owns_file:
+            self._file.close()
+        else:
+            self._file.flush()
+        self._file = None
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ZstdFile(object):
+    """
+    forward-seekable zstandard stream; seeking backwards restarts
+    decompression from the beginning of the file
+    """
+    def __init__(self, path):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError('reading .zst files requires the zstandard package')
+        self.name = path
+        self._dctx = zstandard.ZstdDecompressor()
+        self._file = None
+        self._stream = None
+        self._pos = 0
+        self._rewind()
+
+    def _rewind(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = open(self.name, 'rb')
+        self._stream = self._dctx.stream_reader(self._file)
+        self._pos = 0
+
+    def read(self, size=-1):
+        if size < 0:
+            chunks = []
+            while True:
+                chunk = self._stream.read(1 << 20)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            data = ''.join(chunks)
+        else:
+            data = self._stream.read(size)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            raise IOError('seeking from the end of a zstandard stream is not supported')
+        if offset < self._pos:
+            self._rewind()
+        while self._pos < offset:
+            if not self.read(min(offset - self._pos, 1 << 20)):
+                break
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
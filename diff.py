@@ -0,0 +1,131 @@
+# encoding: utf-8
+"""
+differences between two dumps of the same catalogue
+
+    changes = diff_dumps(Reader(UnimarcRecord, 'yesterday.mrc'), Reader(UnimarcRecord, 'today.mrc'),
+                         out=open('changed.mrc', 'wb'), deletes_out=open('deleted.txt', 'w'))
+
+Records are matched by 001 and compared by fingerprint, both taken from the
+raw records without decoding. Added and changed records are copied raw to
+out, deleted identifiers are written one per line to deletes_out.
+
+By default the old dump is held as identifier -> (record number,
+fingerprint) and the new dump is streamed against it. With presorted=True
+both dumps must be ordered by identifier (see sorting.sort_records) and are
+merged in a single pass holding nothing in memory.
+"""
+import hashlib
+
+from fingerprint import raw_fingerprint
+from iso2709 import iter_fields
+from sorting import control_field_key
+
+
+class ChangeSet(object):
+    def __init__(self):
+        self.adds = []
+        self.changes = []
+        self.deletes = []
+        # identifier -> tags whose content changed, with field_details
+        self.changed_fields = {}
+
+    def __len__(self):
+        return len(self.adds) + len(self.changes) + len(self.deletes)
+
+
+def _field_hashes(raw):
+    hashes = {}
+    for tag, data in iter_fields(raw):
+        hashes.setdefault(tag, []).append(hashlib.md5(data).digest())
+    return hashes
+
+
+def changed_tags(old_raw, new_raw):
+    """
+    returns the sorted tags whose fields differ between two raw records
+    """
+    old = _field_hashes(old_raw)
+    new = _field_hashes(new_raw)
+    return sorted(tag for tag in set(old) | set(new) if old.get(tag) != new.get(tag))
+
+
+def _iter_keyed(reader, key):
+    for item, raw in enumerate(reader.iter_raw()):
+        yield key(raw), item, raw
+
+
+def diff_dumps(old_reader, new_reader, out=None, deletes_out=None, key=control_field_key('001'),
+               compare=raw_fingerprint, presorted=False, field_details=False):
+    """
+    old_reader, new_reader - Readers of the previous and the current dump
+    out - binary file for added and changed raw records
+    deletes_out - file for identifiers of deleted records
+    key - identifier of a raw record
+    compare - fingerprint of a raw record, records with equal fingerprints
+        are unchanged
+    presorted - both dumps are ordered by key
+    field_details - collect the changed tags of each changed record
+    returns ChangeSet
+    """
+    changes = ChangeSet()
+
+    def changed(identifier, old_raw, new_raw):
+        changes.changes.append(identifier)
+        if field_details:
+            changes.changed_fields[identifier] = changed_tags(old_raw, new_raw)
+        if out is not None:
+            out.write(new_raw)
+
+    def added(identifier, raw):
+        changes.adds.append(identifier)
+        if out is not None:
+            out.write(raw)
+
+    if presorted:
+        _merge_sorted(old_reader, new_reader, key, compare, changes, added, changed)
+    else:
+        old = {}
+        for identifier, item, raw in _iter_keyed(old_reader, key):
+            old[identifier] = (item, compare(raw))
+
+        for identifier, item, raw in _iter_keyed(new_reader, key):
+            previous = old.pop(identifier, None)
+            if previous is None:
+                added(identifier, raw)
+            elif previous[1] != compare(raw):
+                changed(identifier, old_reader.raw(previous[0]), raw)
+
+        changes.deletes = [identifier for identifier, previous in
+                           sorted(old.iteritems(), key=lambda entry: entry[1][0])]
+
+    if deletes_out is not None:
+        for identifier in changes.deletes:
+            deletes_out.write('%s\n' % identifier)
+    return changes
+
+
+def _merge_sorted(old_reader, new_reader, key, compare, changes, added, changed):
+    old_records = _iter_keyed(old_reader, key)
+    new_records = _iter_keyed(new_reader, key)
+    old = next(old_records, None)
+    new = next(new_records, None)
+
+    while old is not None and new is not None:
+        if old[0] < new[0]:
+            changes.deletes.append(old[0])
+            old = next(old_records, None)
+        elif new[0] < old[0]:
+            added(new[0], new[2])
+            new = next(new_records, None)
+        else:
+            if compare(old[2]) != compare(new[2]):
+                changed(new[0], old[2], new[2])
+            old = next(old_records, None)
+            new = next(new_records, None)
+
+    while old is not None:
+        changes.deletes.append(old[0])
+        old = next(old_records, None)
+    while new is not None:
+        added(new[0], new[2])
+        new = next(new_records, None)
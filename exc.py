@@ -41,4 +41,8 @@ class FieldNotFound(PymarcException):
 
 class WrongLinkedField(PymarcException):
     def __str__(self):
-        return "Linked field of record is wrong or this not unimarc record"
\ No newline at end of file
+        return "Linked field of record is wrong or this not unimarc record"
+
+class FieldLengthInvalid(PymarcException):
+    def __str__(self):
+        return "Field or record too long for the directory"
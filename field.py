@@ -1,12 +1,25 @@
 # encoding: utf-8
 from constants import SUBFIELD_INDICATOR, END_OF_FIELD
+from marc8 import decode_data
+from storage import IndexedList
+from tables import TAGS, CHARS
 
 
 class Subfield(object):
     def __init__(self, code, data):
-        self.code = unicode(code)
+        self.code = CHARS.get(code) or unicode(code)
         self.data = unicode(data)
 
+    @classmethod
+    def _from_decoded(cls, code, data):
+        """
+        constructor for the decoders, code and data are already unicode
+        """
+        subfield = cls.__new__(cls)
+        subfield.code = code
+        subfield.data = data
+        return subfield
+
     def to_dict(self):
         return ( self.code, self.data )
 
@@ -24,9 +37,30 @@ class Subfield(object):
 
 
 class LinkedSubfield(object):
-    def __init__(self, code, field=None):
-        self.code = unicode(code)
-        self.field = field
+    def __init__(self, code, field=None, raw=None, raw_encoding='utf-8'):
+        """
+        code - subfield code
+        field - embedded ControlField or DataField
+        raw - undecoded embedded field (tag, indicators and subfields as they
+            follow the $1 code); field is decoded from it on first access
+        raw_encoding - encoding of raw
+        """
+        self.code = CHARS.get(code) or unicode(code)
+        self._field = field
+        self.raw = raw
+        self.raw_encoding = raw_encoding
+
+    @property
+    def field(self):
+        if self._field is None and self.raw is not None:
+            self._field = decode_linked_field(self.raw, self.raw_encoding)
+            self.raw = None
+        return self._field
+
+    @field.setter
+    def field(self, value):
+        self._field = value
+        self.raw = None
 
     def to_dict(self):
         return (self.code, self.field.to_dict())
@@ -35,6 +69,11 @@ class LinkedSubfield(object):
         """
         used during conversion of a field to raw marc
         """
+        # an untouched linked field is copied as is
+        if self.raw is not None and self.raw_encoding != 'marc8' and \
+                self.raw_encoding.lower() == to_encoding.lower():
+            return SUBFIELD_INDICATOR + str(self.code) + self.raw
+
         # cut last END_OF_FIELD byte
         if isinstance(self.field, ControlField):
             return SUBFIELD_INDICATOR + str(self.code) + self.field.as_marc()[0:-1]
@@ -48,9 +87,30 @@ class LinkedSubfield(object):
         return unicode(self).encode('utf-8')
 
 
+def decode_linked_field(raw, raw_encoding):
+    """
+    decodes the field embedded in a UNIMARC $1 linked subfield
+    """
+    subs = raw.split(SUBFIELD_INDICATOR)
+    data = subs[0]
+    linked_field_tag = TAGS.get(data[0:3]) or unicode(data[0:3])
+    if linked_field_tag < '010':
+        # the data of a linked control field starts with its tag
+        return ControlField._from_decoded(linked_field_tag, decode_data(data, raw_encoding))
+
+    subfields = []
+    for subfield in subs[1:]:
+        if len(subfield) == 0:
+            continue
+        subfields.append(Subfield._from_decoded(CHARS.get(subfield[0]) or unicode(subfield[0]),
+                                                decode_data(subfield[1:], raw_encoding)))
+    return DataField._from_decoded(linked_field_tag, CHARS.get(data[3]) or unicode(data[3]),
+                                   CHARS.get(data[4]) or unicode(data[4]), subfields)
+
+
 class Field(object):
     def __init__(self, tag):
-        self.tag = unicode(tag)
+        self.tag = TAGS.get(tag) or unicode(tag)
 
     def to_dict(self):
         datafield_dict = {
@@ -60,11 +120,10 @@ class Field(object):
             'subfields': {}
         }
 
-        for key in  sorted(self.subfields.iterkeys()):
-            for subfield in self.subfields[key]:
-                if subfield.code not in datafield_dict['subfields']:
-                    datafield_dict['subfields'][subfield.code] = []
-                datafield_dict['subfields'][subfield.code].append(subfield.to_dict())
+        for subfield in self.subfields.ordered():
+            if subfield.code not in datafield_dict['subfields']:
+                datafield_dict['subfields'][subfield.code] = []
+            datafield_dict['subfields'][subfield.code].append(subfield.to_dict())
 
         return datafield_dict
 
@@ -73,6 +132,16 @@ class ControlField(Field):
         super(ControlField, self).__init__(tag)
         self.data = unicode(data)
 
+    @classmethod
+    def _from_decoded(cls, tag, data):
+        """
+        constructor for the decoders, tag and data are already unicode
+        """
+        field = cls.__new__(cls)
+        field.tag = tag
+        field.data = data
+        return field
+
     def as_marc(self, to_encoding='utf-8'):
         """
         used during conversion of a field to raw marc
@@ -92,22 +161,34 @@ class ControlField(Field):
 class DataField(Field):
     def __init__(self, tag, subfields=[], ind1=u' ', ind2=u' '):
         super(DataField, self).__init__(tag)
-        self.ind1 = unicode(ind1)
-        self.ind2 = unicode(ind2)
-        self.subfields = {}
-
-        for subfield in subfields:
-            if subfield.code not in self.subfields:
-                self.subfields[subfield.code] = []
-            self.subfields[subfield.code].append(subfield)
+        self.ind1 = CHARS.get(ind1) or unicode(ind1)
+        self.ind2 = CHARS.get(ind2) or unicode(ind2)
+        # subfields in their original sequence, subfields['a'] still
+        # returns the $a subfields, as a live view that can be changed
+        self.subfields = IndexedList('code', subfields)
+
+    @classmethod
+    def _from_decoded(cls, tag, ind1, ind2, subfields):
+        """
+        constructor for the decoders, tag, indicators and subfields are
+        already unicode and Subfield objects
+        """
+        field = cls.__new__(cls)
+        field.tag = tag
+        field.ind1 = ind1
+        field.ind2 = ind2
+        field.subfields = IndexedList('code', subfields)
+        return field
+
     def __getitem__(self, item):
         return self.subfields[item]
 
+    def __setitem__(self, item, subfields):
+        self.subfields[item] = subfields
+
 
     def add_subfield(self, subfield):
-        if subfield.code not in self.subfields:
-            self.subfields[subfield.code] = []
-        self.subfields[subfield.code].append(subfield)
+        self.subfields.append(subfield)
 
 
 
@@ -117,9 +198,8 @@ class DataField(Field):
         """
 
         marc = [str(self.ind1) + str(self.ind2)]
-        for key in sorted(self.subfields.iterkeys()):
-            for subfield in self.subfields[key]:
-                marc.append(subfield.as_marc(to_encoding))
+        for subfield in self.subfields.ordered():
+            marc.append(subfield.as_marc(to_encoding))
         marc.append(END_OF_FIELD)
         return ''.join(marc)
 
@@ -136,12 +216,11 @@ class DataField(Field):
             ind2 = self.ind2
 
         strings = []
-        for key in  sorted(self.subfields.iterkeys()):
-            for subfield in self.subfields[key]:
-                if isinstance(subfield, LinkedSubfield):
-                    strings.append(u'\n    ' + unicode(subfield))
-                else:
-                    strings.append(unicode(subfield))
+        for subfield in self.subfields.ordered():
+            if isinstance(subfield, LinkedSubfield):
+                strings.append(u'\n    ' + unicode(subfield))
+            else:
+                strings.append(unicode(subfield))
 
         return u'%s %s%s %s' % (self.tag, ind1, ind2, u' '.join(strings))
 
@@ -0,0 +1,180 @@
+# encoding: utf-8
+"""
+record fingerprints and duplicate detection
+
+fingerprint() hashes all fields except volatile ones (005) in tag order, so
+two copies of a record that differ only in field order or transaction time
+match. Match keys hash a normalized selection of subfields (by default
+title, author and date) to find the same work catalogued twice.
+
+find_duplicates() takes fingerprints straight from raw records and keeps
+them in an open addressing table of machine words instead of a dict, so a
+pass over tens of millions of records stays within a few hundred MB. Two
+different records share a 64-bit fingerprint with negligible probability.
+"""
+import hashlib
+import re
+import struct
+import unicodedata
+from array import array
+
+from iso2709 import iter_fields, iter_subfields
+from marc8 import decode_data
+
+VOLATILE_TAGS = frozenset(['005'])
+
+MARC21_MATCH_KEY = (('245', 'ab'), ('100', 'a'), ('260', 'c'))
+UNIMARC_MATCH_KEY = (('200', 'a'), ('700', 'a'), ('210', 'd'))
+
+# width of the table slots; fingerprints are truncated to it
+FINGERPRINT_BITS = array('L').itemsize * 8
+_FINGERPRINT_MASK = (1 << FINGERPRINT_BITS) - 1
+
+_NOT_WORD = re.compile(r'\W+', re.UNICODE)
+
+
+def _hash(chunks):
+    digest = hashlib.md5()
+    for chunk in chunks:
+        digest.update(chunk)
+    return struct.unpack('<Q', digest.digest()[:8])[0] & _FINGERPRINT_MASK
+
+
+def _field_chunks(fields):
+    for tag, data in sorted(fields, key=lambda field: field[0]):
+        yield '%s%d:' % (tag, len(data))
+        yield data
+
+
+def raw_fingerprint(raw, exclude=VOLATILE_TAGS):
+    """
+    fingerprint of a raw record; equals record.fingerprint() for utf-8
+    records
+    """
+    return _hash(_field_chunks((tag, data) for tag, data in iter_fields(raw) if tag not in exclude))
+
+
+def fingerprint(record, exclude=VOLATILE_TAGS):
+    fields = [(str(field.tag), field.as_marc('utf-8')[:-1]) for field in record.fields.ordered()
+              if field.tag not in exclude]
+    return _hash(_field_chunks(fields))
+
+
+def normalize(text):
+    """
+    lower case, no diacritics, words separated by single spaces
+    """
+    text = unicodedata.normalize('NFKD', text)
+    text = u''.join(char for char in text if not unicodedata.combining(char))
+    return u' '.join(_NOT_WORD.sub(u' ', text.lower()).split())
+
+
+def match_key(record, spec):
+    """
+    spec - sequence of (tag, subfield codes); returns the normalized values
+    of the first field of each tag joined with '|'
+    """
+    parts = []
+    for tag, codes in spec:
+        values = []
+        fields = record.fields.get(tag)
+        if fields:
+            for subfield in fields[0].subfields.ordered():
+                if subfield.code in codes:
+                    values.append(subfield.data)
+        parts.append(normalize(u' '.join(values)))
+    return u'|'.join(parts)
+
+
+def raw_match_key(raw, spec, raw_encoding='utf-8'):
+    """
+    match_key computed from a raw record, decoding only the used subfields
+    """
+    firsts = {}
+    tags = frozenset(tag for tag, codes in spec)
+    for tag, data in iter_fields(raw, tags):
+        if tag not in firsts:
+            firsts[tag] = data
+
+    parts = []
+    for tag, codes in spec:
+        values = []
+        for code, data in iter_subfields(firsts.get(tag, '')):
+            if code in codes:
+                values.append(decode_data(data, raw_encoding, 'replace'))
+        parts.append(normalize(u' '.join(values)))
+    return u'|'.join(parts)
+
+
+def match_fingerprint(key):
+    return _hash([key.encode('utf-8')])
+
+
+def match_key_function(spec, raw_encoding='utf-8'):
+    """
+    returns key(raw) for find_duplicates comparing match keys
+    """
+    def key(raw):
+        return match_fingerprint(raw_match_key(raw, spec, raw_encoding))
+    return key
+
+
+class FingerprintTable(object):
+    """
+    open addressing hash table from fingerprint to record number
+    """
+    def __init__(self, capacity=1 << 16):
+        size = 1
+        while size < capacity:
+            size <<= 1
+        self._keys = array('L', [0]) * size
+        self._values = array('l', [0]) * size
+        self._used = 0
+
+    def __len__(self):
+        return self._used
+
+    def _grow(self):
+        keys, values = self._keys, self._values
+        self._keys = array('L', [0]) * (len(keys) * 2)
+        self._values = array('l', [0]) * (len(keys) * 2)
+        self._used = 0
+        for slot in xrange(len(keys)):
+            if keys[slot]:
+                self._insert(keys[slot], values[slot])
+
+    def _insert(self, key, value):
+        mask = len(self._keys) - 1
+        slot = key & mask
+        while True:
+            stored = self._keys[slot]
+            if stored == key:
+                return self._values[slot]
+            if not stored:
+                self._keys[slot] = key
+                self._values[slot] = value
+                self._used += 1
+                return value
+            slot = (slot + 1) & mask
+
+    def setdefault(self, fingerprint, value):
+        """
+        returns the value stored for fingerprint, storing value if none is
+        """
+        # 0 marks an empty slot
+        key = fingerprint or 1
+        if (self._used + 1) * 3 > len(self._keys) * 2:
+            self._grow()
+        return self._insert(key, value)
+
+
+def find_duplicates(reader, key=raw_fingerprint, capacity=1 << 20):
+    """
+    yields (record number, number of its first occurrence) for every record
+    of reader whose key(raw) was already seen, in one pass
+    """
+    table = FingerprintTable(capacity)
+    for item, raw in enumerate(reader.iter_raw()):
+        first = table.setdefault(key(raw), item)
+        if first != item:
+            yield item, first
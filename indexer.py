@@ -0,0 +1,148 @@
+# encoding: utf-8
+"""
+parallel construction of the record offset index
+
+    index, end = parallel_index('dump.mrc', processes=8)
+
+The length prefix of each record gives the offset of the next one, so a
+single scan is inherently sequential. Here the file is cut into byte ranges
+and every worker maps the file, finds the first record boundary in its
+range (the byte after an END_OF_RECORD where a plausible record starts,
+followed by another one or the end of the file) and walks records from
+there past the end of its range. The parent stitches the ranges where one
+walk reaches the first boundary of the next; where they disagree (a
+damaged record, a false boundary) it walks that stretch itself.
+"""
+import mmap
+from array import array
+from bisect import bisect_left
+from multiprocessing import Pool, cpu_count
+
+import exc
+from constants import LEADER_LEN, END_OF_RECORD
+
+# files smaller than this are not worth starting workers for
+MIN_RANGE_SIZE = 4 * 1024 * 1024
+
+
+def _map(path):
+    with open(path, 'rb') as source:
+        if not source.read(1):
+            return None
+        return mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _record_length(data, offset):
+    """
+    length of a well formed record starting at offset, 0 if there is none
+    """
+    prefix = data[offset:offset + 5]
+    if len(prefix) < 5 or not prefix.isdigit():
+        return 0
+    length = int(prefix)
+    if length <= LEADER_LEN or offset + length > len(data):
+        return 0
+    if data[offset + length - 1] != END_OF_RECORD or not data[offset + 12:offset + 17].isdigit():
+        return 0
+    return length
+
+
+def _first_boundary(data, start, stop):
+    """
+    offset of the first record starting in [start, stop), or None
+    """
+    offset = start
+    if start:
+        offset = data.find(END_OF_RECORD, start - 1, stop) + 1
+    while offset and offset < stop:
+        length = _record_length(data, offset)
+        if length and (offset + length == len(data) or _record_length(data, offset + length)):
+            return offset
+        offset = data.find(END_OF_RECORD, offset, stop) + 1
+    return 0 if start == 0 else None
+
+
+def index_range(args):
+    """
+    (path, start, stop) -> (offsets, lengths, end) of the records walked
+    from the first boundary in [start, stop); end is where the walk stopped,
+    at or after stop unless a damaged record was met
+    """
+    path, start, stop = args
+    offsets = array('l')
+    lengths = array('l')
+    data = _map(path)
+    if data is None:
+        return offsets, lengths, start
+    try:
+        offset = _first_boundary(data, start, stop)
+        if offset is None:
+            return offsets, lengths, start
+        while offset < stop:
+            length = _record_length(data, offset)
+            if not length:
+                break
+            offsets.append(offset)
+            lengths.append(length)
+            offset += length
+        return offsets, lengths, offset
+    finally:
+        data.close()
+
+
+def _walk(data, offset, stop, index):
+    """
+    sequential scan by length prefix, as Reader does it
+    """
+    while offset < stop and offset < len(data):
+        first5 = data[offset:offset + 5]
+        if len(first5) < 5:
+            raise exc.RecordLengthInvalid
+        length = int(first5)
+        index.append((offset, length))
+        offset += length
+    return offset
+
+
+def parallel_index(path, processes=None, range_size=None):
+    """
+    path - plain ISO 2709 file
+    processes - worker processes, cpu count if None
+    range_size - bytes scanned by one task, by default the file is split
+        into four ranges per process
+    returns (list of (offset, length), end offset of the last record)
+    """
+    processes = processes or cpu_count()
+    data = _map(path)
+    if data is None:
+        return [], 0
+
+    try:
+        size = len(data)
+        range_size = max(range_size or size // (processes * 4) + 1, MIN_RANGE_SIZE)
+        if range_size >= size or processes == 1:
+            index = []
+            return index, _walk(data, 0, size, index)
+
+        ranges = [(path, start, min(start + range_size, size)) for start in xrange(0, size, range_size)]
+        pool = Pool(processes)
+        try:
+            results = pool.map(index_range, ranges)
+        finally:
+            pool.close()
+            pool.join()
+
+        index = []
+        offset = 0
+        for (path, start, stop), (offsets, lengths, end) in zip(ranges, results):
+            if offset >= stop:
+                continue
+            first = bisect_left(offsets, offset)
+            if first < len(offsets) and offsets[first] == offset:
+                index.extend(zip(offsets[first:], lengths[first:]))
+                offset = end
+            if offset < stop:
+                offset = _walk(data, offset, stop, index)
+        return index, offset
+    finally:
+        data.close()
@@ -0,0 +1,223 @@
+# encoding: utf-8
+"""
+helpers working on raw ISO 2709 records without building field objects
+"""
+import exc
+from constants import LEADER_LEN, DIRECTORY_ENTRY_LEN, SUBFIELD_INDICATOR, END_OF_FIELD, END_OF_RECORD
+
+
+def read_directory(raw):
+    """
+    returns list of (tag, length, offset) directory entries, offset is
+    counted from the start of the record and length includes END_OF_FIELD
+    """
+    base_address = int(raw[12:17])
+    if base_address <= 0:
+        raise exc.BaseAddressNotFound
+    if base_address >= len(raw):
+        raise exc.BaseAddressInvalid
+
+    directory = raw[LEADER_LEN:base_address - 1]
+    if len(directory) % DIRECTORY_ENTRY_LEN != 0:
+        raise exc.RecordDirectoryInvalid
+
+    entries = []
+    for start in xrange(0, len(directory), DIRECTORY_ENTRY_LEN):
+        entry = directory[start:start + DIRECTORY_ENTRY_LEN]
+        entries.append((entry[0:3], int(entry[3:7]), base_address + int(entry[7:12])))
+    return entries
+
+
+def iter_fields(raw, tags=None):
+    """
+    yields (tag, data) for the fields of raw, data is undecoded and has no
+    END_OF_FIELD; tags - if given, only fields with these tags
+    """
+    for tag, length, offset in read_directory(raw):
+        if tags is None or tag in tags:
+            yield tag, raw[offset:offset + length - 1]
+
+
+def iter_subfields(data):
+    """
+    yields (code, data) for the undecoded subfields of data field data
+    """
+    for subfield in data.split(SUBFIELD_INDICATOR)[1:]:
+        if subfield:
+            yield subfield[0], subfield[1:]
+
+
+def find_field(raw, tag, occurrence=0):
+    """
+    returns the directory position of the occurrence of tag, or None
+    """
+    seen = 0
+    for position, (entry_tag, length, offset) in enumerate(read_directory(raw)):
+        if entry_tag == tag:
+            if seen == occurrence:
+                return position
+            seen += 1
+    return None
+
+
+def _entry(tag, length, offset):
+    if len(tag) != 3:
+        raise exc.RecordDirectoryInvalid
+    if length > 9999 or offset > 99999:
+        raise exc.FieldLengthInvalid
+    return '%s%04d%05d' % (tag, length, offset)
+
+
+def _assemble(raw, directory, data):
+    """
+    new record from the leader of raw and the given directory entries and
+    field data, with record length and base address updated
+    """
+    base_address = LEADER_LEN + len(directory) + 1
+    length = base_address + len(data)
+    if length > 99999:
+        raise exc.FieldLengthInvalid
+    return ''.join(('%05d' % length, raw[5:12], '%05d' % base_address, raw[17:LEADER_LEN],
+                    directory, END_OF_FIELD, data))
+
+
+def replace_field(raw, position, data):
+    """
+    returns raw with the field at directory position replaced by data
+    (field bytes ending with END_OF_FIELD); the bytes of all other fields
+    are copied as they are, only directory offsets behind it shift
+    """
+    base_address = int(raw[12:17])
+    entries = read_directory(raw)
+    tag, old_length, old_offset = entries[position]
+    delta = len(data) - old_length
+
+    directory = raw[LEADER_LEN:base_address - 1]
+    if delta:
+        parts = []
+        for entry_position, (entry_tag, length, offset) in enumerate(entries):
+            if entry_position == position:
+                length = len(data)
+            elif offset > old_offset:
+                offset += delta
+            parts.append(_entry(entry_tag, length, offset - base_address))
+        directory = ''.join(parts)
+
+    return _assemble(raw, directory, raw[base_address:old_offset] + data + raw[old_offset + old_length:])
+
+
+def insert_field(raw, tag, data):
+    """
+    returns raw with a field added; its directory entry goes after the
+    entries with tags up to tag, its data at the end of the data area, so
+    no other entry changes
+    """
+    base_address = int(raw[12:17])
+    entries = read_directory(raw)
+    position = len(entries)
+    while position and entries[position - 1][0] > tag:
+        position -= 1
+
+    directory = raw[LEADER_LEN:base_address - 1]
+    split = position * DIRECTORY_ENTRY_LEN
+    entry = _entry(tag, len(data), len(raw) - 1 - base_address)
+    return _assemble(raw, directory[:split] + entry + directory[split:],
+                     raw[base_address:-1] + data + raw[-1])
+
+
+def delete_field(raw, position):
+    """
+    returns raw without the field at directory position
+    """
+    base_address = int(raw[12:17])
+    entries = read_directory(raw)
+    tag, old_length, old_offset = entries[position]
+
+    parts = []
+    for entry_position, (entry_tag, length, offset) in enumerate(entries):
+        if entry_position == position:
+            continue
+        if offset > old_offset:
+            offset -= old_length
+        parts.append(_entry(entry_tag, length, offset - base_address))
+
+    return _assemble(raw, ''.join(parts), raw[base_address:old_offset] + raw[old_offset + old_length:])
+
+
+# problems reported by verify
+STRUCTURE_ERRORS = {
+    'record_length': 'record length in the leader differs from the record size',
+    'record_terminator': 'record does not end with END_OF_RECORD',
+    'leader_counts': 'indicator or subfield code count in the leader is not 2',
+    'entry_map': 'directory entry map in the leader is not 450',
+    'base_address': 'base address is not a number within the record',
+    'directory_length': 'directory is not a whole number of entries',
+    'directory_terminator': 'directory does not end with END_OF_FIELD',
+    'no_fields': 'directory has no entries',
+    'directory_entry': 'directory entry length or offset is not a number',
+    'field_bounds': 'field lies outside the data area',
+    'field_overlap': 'field overlaps the previous one',
+    'field_terminator': 'field does not end with END_OF_FIELD',
+}
+
+# errors after which the directory cannot be used to locate the fields;
+# the others leave the fields readable
+DIRECTORY_ERRORS = frozenset(['base_address', 'directory_length', 'directory_entry', 'field_bounds'])
+
+
+def verify(raw):
+    """
+    checks the structure of a raw record using the leader and directory
+    only; returns a list of (error, directory position or None), empty for
+    a sound record. Errors are the keys of STRUCTURE_ERRORS.
+    """
+    errors = []
+    size = len(raw)
+    if size <= LEADER_LEN or not raw[0:5].isdigit() or int(raw[0:5]) != size:
+        errors.append(('record_length', None))
+        if size <= LEADER_LEN:
+            errors.append(('base_address', None))
+            return errors
+    if raw[-1] != END_OF_RECORD:
+        errors.append(('record_terminator', None))
+    if raw[10:12] != '22':
+        errors.append(('leader_counts', None))
+    if raw[20:23] != '450':
+        errors.append(('entry_map', None))
+
+    base_address = raw[12:17]
+    if not base_address.isdigit() or not LEADER_LEN < int(base_address) < size:
+        errors.append(('base_address', None))
+        return errors
+    base_address = int(base_address)
+    if (base_address - 1 - LEADER_LEN) % DIRECTORY_ENTRY_LEN:
+        errors.append(('directory_length', None))
+        return errors
+    if raw[base_address - 1] != END_OF_FIELD:
+        errors.append(('directory_terminator', None))
+    if base_address - 1 == LEADER_LEN:
+        errors.append(('no_fields', None))
+
+    # the data area ends before END_OF_RECORD
+    data_end = size - 1
+    spans = []
+    for position, start in enumerate(xrange(LEADER_LEN, base_address - 1, DIRECTORY_ENTRY_LEN)):
+        length = raw[start + 3:start + 7]
+        offset = raw[start + 7:start + 12]
+        if not length.isdigit() or not offset.isdigit():
+            errors.append(('directory_entry', position))
+            continue
+        first = base_address + int(offset)
+        end = first + int(length)
+        if int(length) == 0 or end > data_end:
+            errors.append(('field_bounds', position))
+            continue
+        if raw[end - 1] != END_OF_FIELD:
+            errors.append(('field_terminator', position))
+        spans.append((first, end, position))
+
+    spans.sort()
+    for previous, span in zip(spans, spans[1:]):
+        if span[0] < previous[1]:
+            errors.append(('field_overlap', span[2]))
+    return errors
@@ -0,0 +1,178 @@
+# encoding: utf-8
+"""
+graph of UNIMARC 4xx links between records
+
+    graph = LinkGraph.from_reader(Reader(UnimarcRecord, source))
+    graph.children('RU\\NLR\\000000001')
+
+Links are the $1001 identifiers embedded in 4xx fields. They are read from
+the raw records, so building the graph decodes neither fields nor linked
+subfields, and queries only touch the adjacency arrays. Identifiers are
+compared as raw byte strings.
+"""
+from array import array
+from collections import deque
+
+from iso2709 import iter_fields, iter_subfields
+
+LINK_TAGS = frozenset('%03d' % tag for tag in xrange(400, 500))
+_RECORD_LINK_TAGS = LINK_TAGS | frozenset(['001'])
+
+# 461 set and 462 subset point from a record to the record containing it,
+# 463 piece and 464 piece-analytic point to the records it contains
+PARENT_TAGS = ('461', '462')
+CHILD_TAGS = ('463', '464')
+
+
+def _csr(keys, count):
+    """
+    counting sort of edges by key; returns (offsets, edges) where the edges
+    of node n are edges[offsets[n]:offsets[n + 1]]
+    """
+    offsets = array('l', [0]) * (count + 1)
+    for key in keys:
+        offsets[key + 1] += 1
+    for node in xrange(count):
+        offsets[node + 1] += offsets[node]
+
+    fill = array('l', offsets)
+    edges = array('l', [0]) * len(keys)
+    for edge, key in enumerate(keys):
+        edges[fill[key]] = edge
+        fill[key] += 1
+    return offsets, edges
+
+
+def record_links(raw):
+    """
+    returns (001 identifier, [(link tag, target identifier)]) of a raw record
+    """
+    identifier = None
+    links = []
+    for tag, data in iter_fields(raw, _RECORD_LINK_TAGS):
+        if tag == '001':
+            identifier = data
+            continue
+        for code, subfield_data in iter_subfields(data):
+            if code == '1' and subfield_data.startswith('001'):
+                links.append((tag, subfield_data[3:]))
+    return identifier, links
+
+
+class LinkGraph(object):
+    def __init__(self):
+        self._ids = []
+        self._nodes = {}
+        self._sources = array('l')
+        self._targets = array('l')
+        self._tags = array('H')
+        self._forward = None
+        self._backward = None
+
+    @classmethod
+    def from_reader(cls, reader):
+        graph = cls()
+        for record in reader:
+            raw = record.raw or record.as_marc()
+            identifier, links = record_links(raw)
+            if identifier is None:
+                continue
+            for tag, target in links:
+                graph.add_link(identifier, tag, target)
+        return graph
+
+    def _node(self, identifier):
+        if isinstance(identifier, unicode):
+            identifier = identifier.encode('utf-8')
+        node = self._nodes.get(identifier)
+        if node is None:
+            node = self._nodes[identifier] = len(self._ids)
+            self._ids.append(identifier)
+        return node
+
+    def add_link(self, source, tag, target):
+        self._sources.append(self._node(source))
+        self._tags.append(int(tag))
+        self._targets.append(self._node(target))
+        self._forward = self._backward = None
+
+    def __len__(self):
+        return len(self._tags)
+
+    def __contains__(self, identifier):
+        if isinstance(identifier, unicode):
+            identifier = identifier.encode('utf-8')
+        return identifier in self._nodes
+
+    def triples(self):
+        """
+        yields (source 001, link tag, target 001)
+        """
+        for edge in xrange(len(self._tags)):
+            yield (self._ids[self._sources[edge]], '%03d' % self._tags[edge],
+                   self._ids[self._targets[edge]])
+
+    def _adjacent(self, identifier, tags, backward):
+        if identifier not in self:
+            return []
+        if self._forward is None:
+            self._forward = _csr(self._sources, len(self._ids))
+            self._backward = _csr(self._targets, len(self._ids))
+
+        node = self._node(identifier)
+        offsets, edges = self._backward if backward else self._forward
+        ends = self._sources if backward else self._targets
+        tags = tags and set(int(tag) for tag in tags)
+
+        result = []
+        for i in xrange(offsets[node], offsets[node + 1]):
+            edge = edges[i]
+            if tags is None or self._tags[edge] in tags:
+                result.append(('%03d' % self._tags[edge], self._ids[ends[edge]]))
+        return result
+
+    def targets(self, identifier, tags=None):
+        """
+        returns [(link tag, target 001)] of links made by record identifier
+        """
+        return self._adjacent(identifier, tags, backward=False)
+
+    def sources(self, identifier, tags=None):
+        """
+        returns [(link tag, source 001)] of links pointing to record identifier
+        """
+        return self._adjacent(identifier, tags, backward=True)
+
+    def _related(self, identifier, forward_tags, backward_tags):
+        result = []
+        seen = set()
+        links = self.targets(identifier, forward_tags) + self.sources(identifier, backward_tags)
+        for tag, related in links:
+            if related not in seen:
+                seen.add(related)
+                result.append(related)
+        return result
+
+    def children(self, identifier):
+        return self._related(identifier, CHILD_TAGS, PARENT_TAGS)
+
+    def parents(self, identifier):
+        return self._related(identifier, PARENT_TAGS, CHILD_TAGS)
+
+    def ancestors(self, identifier):
+        """
+        returns all records above identifier, nearest first
+        """
+        if isinstance(identifier, unicode):
+            identifier = identifier.encode('utf-8')
+        result = []
+        seen = set([identifier])
+        queue = deque([identifier])
+        while queue:
+            parents = self.parents(queue.popleft())
+            for parent in parents:
+                if parent not in seen:
+                    seen.add(parent)
+                    result.append(parent)
+                    queue.append(parent)
+        return result
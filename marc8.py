@@ -5,6 +5,7 @@
 import sys
 import unicodedata
 import marc8_mapping
+import stats
 
 
 def marc8_to_unicode(marc8, hide_utf8_warnings=False):
@@ -20,6 +21,16 @@ def marc8_to_unicode(marc8, hide_utf8_warnings=False):
     return converter.translate(marc8)
 
 
+def decode_data(data, raw_encoding, errors='strict'):
+    """
+    decodes undecoded field or subfield data of a record in raw_encoding;
+    errors - codec error handling, not used for marc8
+    """
+    if raw_encoding == 'marc8':
+        return marc8_to_unicode(data)
+    return data.decode(raw_encoding, errors)
+
+
 class MARC8ToUnicode:
     """
     Converts MARC-8 to Unicode.  Note that currently, unicode strings
@@ -51,6 +62,11 @@ class MARC8ToUnicode:
         # don't choke on empty marc8_string
         if not marc8_string:
             return u''
+        if stats.active is None:
+            return self._translate(marc8_string)
+        return stats.measure('marc8.translate', self._translate, (marc8_string, ), len(marc8_string))
+
+    def _translate(self, marc8_string):
         uni_list = []
         combinings = []
         pos = 0
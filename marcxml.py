@@ -1,6 +1,8 @@
 # encoding: utf-8
 from lxml import etree as ET
 
+import stats
+
 from record import Record, UnimarcRecord
 from field import ControlField, LinkedSubfield
 
@@ -10,10 +12,28 @@ MARC_XML_SCHEMA = "http://www.loc.gov/MARC21/slim http://www.loc.gov/standards/m
 
 
 
+def _source_size(record):
+    """
+    bytes of the ISO 2709 record serialized, counted for the xml.* events
+    since the serializers return elements, not strings; 0 for a record
+    built in code that was never encoded
+    """
+    if record.raw:
+        return len(record.raw)
+    length = record.leader[0:5].tostring()
+    return int(length) if length.isdigit() else 0
+
+
 def record_to_marc_xml(record, namespace=False):
     """
     To Marc21slim
     """
+    if stats.active is None:
+        return _record_to_marc_xml(record, namespace)
+    return stats.measure('xml.marc', _record_to_marc_xml, (record, namespace), _source_size(record))
+
+
+def _record_to_marc_xml(record, namespace=False):
     root = ET.Element('record')
     if namespace:
         root.set('xmlns', MARC_XML_NS)
@@ -23,22 +43,20 @@ def record_to_marc_xml(record, namespace=False):
     leader = ET.SubElement(root, 'leader')
     leader.text = record.leader.tostring()
 
-    for key in sorted(record.fields.iterkeys()):
-        for field in record.fields[key]:
-            if isinstance(field, ControlField):
-                control_field = ET.SubElement(root, 'controlfield')
-                control_field.set('tag', field.tag)
-                control_field.text = field.data
-            else:
-                data_field = ET.SubElement(root, 'datafield')
-                data_field.set('tag', field.tag)
-                data_field.set('ind1', field.ind1)
-                data_field.set('ind2', field.ind2)
-                for sf_key in sorted(field.subfields.iterkeys()):
-                    for subfield in field.subfields[sf_key]:
-                        data_subfield = ET.SubElement(data_field, 'subfield')
-                        data_subfield.set('code', subfield.code)
-                        data_subfield.text = subfield.data
+    for field in record.fields.ordered():
+        if isinstance(field, ControlField):
+            control_field = ET.SubElement(root, 'controlfield')
+            control_field.set('tag', field.tag)
+            control_field.text = field.data
+        else:
+            data_field = ET.SubElement(root, 'datafield')
+            data_field.set('tag', field.tag)
+            data_field.set('ind1', field.ind1)
+            data_field.set('ind2', field.ind2)
+            for subfield in field.subfields.ordered():
+                data_subfield = ET.SubElement(data_field, 'subfield')
+                data_subfield.set('code', subfield.code)
+                data_subfield.text = subfield.data
 
     return root
 
@@ -59,6 +77,12 @@ def record_to_unimarc_xml(record, namespace=False):
     """
     To UNISlim
     """
+    if stats.active is None:
+        return _record_to_unimarc_xml(record, namespace)
+    return stats.measure('xml.unimarc', _record_to_unimarc_xml, (record, namespace), _source_size(record))
+
+
+def _record_to_unimarc_xml(record, namespace=False):
     root = ET.Element('record')
     if namespace:
         root.set('xmlns', UNIMARC_MARC_XML_NS)
@@ -68,42 +92,39 @@ def record_to_unimarc_xml(record, namespace=False):
     leader = ET.SubElement(root, 'leader')
     leader.text = record.leader.tostring()
 
-    for key in sorted(record.fields.iterkeys()):
-        for field in record.fields[key]:
-            if isinstance(field, ControlField):
-                control_field = ET.SubElement(root, 'controlfield')
-                control_field.set('tag', field.tag)
-                control_field.text = field.data
-            else:
-                data_field = ET.SubElement(root, 'datafield')
-                data_field.set('tag', field.tag)
-                data_field.set('ind1', field.ind1)
-                data_field.set('ind2', field.ind2)
-                for sf_key in sorted(field.subfields.iterkeys()):
-                    for subfield in field.subfields[sf_key]:
-                        if isinstance(subfield, LinkedSubfield):
-                            linked_subfield = ET.SubElement(data_field, 's1')
-                            if  isinstance(subfield.field, ControlField):
-                                linked_control_field = ET.SubElement(linked_subfield, 'controlfield')
-                                linked_control_field.set('tag', subfield.field.tag)
-                                linked_control_field.text = subfield.field.data
-                            else:
-                                linked_data_field = ET.SubElement(linked_subfield, 'datafield')
-                                linked_data_field.set('tag', subfield.field.tag)
-                                linked_data_field.set('ind1', subfield.field.ind1)
-                                linked_data_field.set('ind2', subfield.field.ind2)
-
-                                # глубже! еще глубже!
-                                for sf_key in sorted(subfield.field.subfields.iterkeys()):
-                                    for lsubfield in subfield.field.subfields[sf_key]:
-                                        linkeddata_subfield = ET.SubElement(linked_data_field, 'subfield')
-                                        linkeddata_subfield.set('code', lsubfield.code)
-                                        linkeddata_subfield.text = lsubfield.data
-
-                        else:
-                            data_subfield = ET.SubElement(data_field, 'subfield')
-                            data_subfield.set('code', subfield.code)
-                            data_subfield.text = subfield.data
+    for field in record.fields.ordered():
+        if isinstance(field, ControlField):
+            control_field = ET.SubElement(root, 'controlfield')
+            control_field.set('tag', field.tag)
+            control_field.text = field.data
+        else:
+            data_field = ET.SubElement(root, 'datafield')
+            data_field.set('tag', field.tag)
+            data_field.set('ind1', field.ind1)
+            data_field.set('ind2', field.ind2)
+            for subfield in field.subfields.ordered():
+                if isinstance(subfield, LinkedSubfield):
+                    linked_subfield = ET.SubElement(data_field, 's1')
+                    if  isinstance(subfield.field, ControlField):
+                        linked_control_field = ET.SubElement(linked_subfield, 'controlfield')
+                        linked_control_field.set('tag', subfield.field.tag)
+                        linked_control_field.text = subfield.field.data
+                    else:
+                        linked_data_field = ET.SubElement(linked_subfield, 'datafield')
+                        linked_data_field.set('tag', subfield.field.tag)
+                        linked_data_field.set('ind1', subfield.field.ind1)
+                        linked_data_field.set('ind2', subfield.field.ind2)
+
+                        # глубже! еще глубже!
+                        for lsubfield in subfield.field.subfields.ordered():
+                            linkeddata_subfield = ET.SubElement(linked_data_field, 'subfield')
+                            linkeddata_subfield.set('code', lsubfield.code)
+                            linkeddata_subfield.text = lsubfield.data
+
+                else:
+                    data_subfield = ET.SubElement(data_field, 'subfield')
+                    data_subfield.set('code', subfield.code)
+                    data_subfield.text = subfield.data
 
     return root
 
@@ -115,6 +136,12 @@ def record_to_rustam_xml(record, syntax='1.2.840.10003.5.28', namespace=False):
     """
     default syntax rusmarc
     """
+    if stats.active is None:
+        return _record_to_rustam_xml(record, syntax, namespace)
+    return stats.measure('xml.rustam', _record_to_rustam_xml, (record, syntax, namespace), _source_size(record))
+
+
+def _record_to_rustam_xml(record, syntax='1.2.840.10003.5.28', namespace=False):
     string_leader = record.leader.tostring()
 
     root = ET.Element('record')
@@ -162,59 +189,56 @@ def record_to_rustam_xml(record, syntax='1.2.840.10003.5.28', namespace=False):
     entry_map = ET.SubElement(leader, 'entryMap')
     entry_map.text = string_leader[20:23]
 
-    for key in sorted(record.fields.iterkeys()):
-        for field in record.fields[key]:
-            if isinstance(field, ControlField):
-                control_field = ET.SubElement(root, 'field')
-                control_field.set('id', field.tag)
-                control_field.text = field.data
-            else:
-                data_field = ET.SubElement(root, 'field')
-                data_field.set('id', field.tag)
-
-                ind1 = ET.SubElement(data_field, 'indicator')
-                ind1.set('id', '1')
-                ind1.text = field.ind1
-
-                ind2 = ET.SubElement(data_field, 'indicator')
-                ind2.set('id', '2')
-                ind2.text = field.ind2
-
-
-                for sf_key in sorted(field.subfields.iterkeys()):
-                    for subfield in field.subfields[sf_key]:
-                        if isinstance(subfield, LinkedSubfield):
-                            linked_subfield = ET.SubElement(data_field, 'subfield')
-                            linked_subfield.set('id', '1')
-
-                            if  isinstance(subfield.field, ControlField):
-                                linked_control_field = ET.SubElement(linked_subfield, 'field')
-                                linked_control_field.set('id', subfield.field.tag)
-                                linked_control_field.text = subfield.field.data
-                            else:
-                                linked_data_field = ET.SubElement(linked_subfield, 'field')
-                                linked_data_field.set('id', subfield.field.tag)
-
-                                linked_ind1 = ET.SubElement(linked_data_field, 'indicator')
-                                linked_ind1.set('id', '1')
-                                linked_ind1.text = subfield.field.ind1
-
-                                linked_ind2 = ET.SubElement(linked_data_field, 'indicator')
-                                linked_ind2.set('id', '2')
-                                linked_ind2.text = subfield.field.ind2
-
-
-                                # глубже! еще глубже!
-                                for sf_key in sorted(subfield.field.subfields.iterkeys()):
-                                    for lsubfield in subfield.field.subfields[sf_key]:
-                                        linkeddata_subfield = ET.SubElement(linked_data_field, 'subfield')
-                                        linkeddata_subfield.set('id', lsubfield.code)
-                                        linkeddata_subfield.text = lsubfield.data
-
-                        else:
-                            data_subfield = ET.SubElement(data_field, 'subfield')
-                            data_subfield.set('id', subfield.code)
-                            data_subfield.text = subfield.data
+    for field in record.fields.ordered():
+        if isinstance(field, ControlField):
+            control_field = ET.SubElement(root, 'field')
+            control_field.set('id', field.tag)
+            control_field.text = field.data
+        else:
+            data_field = ET.SubElement(root, 'field')
+            data_field.set('id', field.tag)
+
+            ind1 = ET.SubElement(data_field, 'indicator')
+            ind1.set('id', '1')
+            ind1.text = field.ind1
+
+            ind2 = ET.SubElement(data_field, 'indicator')
+            ind2.set('id', '2')
+            ind2.text = field.ind2
+
+
+            for subfield in field.subfields.ordered():
+                if isinstance(subfield, LinkedSubfield):
+                    linked_subfield = ET.SubElement(data_field, 'subfield')
+                    linked_subfield.set('id', '1')
+
+                    if  isinstance(subfield.field, ControlField):
+                        linked_control_field = ET.SubElement(linked_subfield, 'field')
+                        linked_control_field.set('id', subfield.field.tag)
+                        linked_control_field.text = subfield.field.data
+                    else:
+                        linked_data_field = ET.SubElement(linked_subfield, 'field')
+                        linked_data_field.set('id', subfield.field.tag)
+
+                        linked_ind1 = ET.SubElement(linked_data_field, 'indicator')
+                        linked_ind1.set('id', '1')
+                        linked_ind1.text = subfield.field.ind1
+
+                        linked_ind2 = ET.SubElement(linked_data_field, 'indicator')
+                        linked_ind2.set('id', '2')
+                        linked_ind2.text = subfield.field.ind2
+
+
+                        # глубже! еще глубже!
+                        for lsubfield in subfield.field.subfields.ordered():
+                            linkeddata_subfield = ET.SubElement(linked_data_field, 'subfield')
+                            linkeddata_subfield.set('id', lsubfield.code)
+                            linkeddata_subfield.text = lsubfield.data
+
+                else:
+                    data_subfield = ET.SubElement(data_field, 'subfield')
+                    data_subfield.set('id', subfield.code)
+                    data_subfield.text = subfield.data
     return root
 
 
@@ -0,0 +1,89 @@
+# encoding: utf-8
+"""
+multi-process conversion of ISO 2709 files to XML collections
+
+    convert_to_xml(Reader(UnimarcRecord, 'dump.mrc'), open('dump.xml', 'wb'),
+                   xml_format='unimarc', processes=4)
+
+Raw records are sent to the workers in chunks, decoded and serialized there,
+and written back in the original order.
+"""
+from lxml import etree as ET
+
+from marcxml import record_to_marc_xml, record_to_unimarc_xml, record_to_rustam_xml, \
+    MARC_XML_NS, UNIMARC_MARC_XML_NS
+from workers import chunks, pool_map
+
+SERIALIZERS = {
+    'marcxml': record_to_marc_xml,
+    'unimarc': record_to_unimarc_xml,
+    'rustam': record_to_rustam_xml,
+}
+
+COLLECTION_NAMESPACES = {
+    'marcxml': MARC_XML_NS,
+    'unimarc': UNIMARC_MARC_XML_NS,
+    'rustam': None,
+}
+
+
+def convert_chunk(args):
+    """
+    (record_cls, raw_encoding, xml_format, raws) -> list of utf-8 xml records
+    """
+    record_cls, raw_encoding, xml_format, raws = args
+    serializer = SERIALIZERS[xml_format]
+    return [ET.tostring(serializer(record_cls(raw, raw_encoding)), encoding='utf-8', xml_declaration=False)
+            for raw in raws]
+
+
+def iter_chunks(raws, record_cls, raw_encoding, xml_format, chunk_size):
+    for chunk in chunks(raws, chunk_size):
+        yield (record_cls, raw_encoding, xml_format, chunk)
+
+
+def convert_to_xml(reader, out, xml_format='marcxml', processes=None, chunk_size=100):
+    """
+    writes the records of reader to out as one xml collection
+    reader - Reader
+    out - binary file
+    xml_format - 'marcxml', 'unimarc' (UNISlim) or 'rustam'
+    processes - number of worker processes, cpu count if None; 1 converts
+        in this process
+    chunk_size - records sent to a worker at once
+    returns the number of converted records
+    """
+    return convert_raw_to_xml(reader.iter_raw(), reader.record_cls, reader.raw_encoding, out,
+                              xml_format, processes, chunk_size)
+
+
+def convert_raw_to_xml(raws, record_cls, raw_encoding, out, xml_format='marcxml', processes=None,
+                       chunk_size=100, progress=None):
+    """
+    as convert_to_xml for an iterable of raw records
+    progress - callable(records, bytes) called after each written chunk
+    """
+    if xml_format not in SERIALIZERS:
+        raise ValueError('unknown xml format %r' % xml_format)
+
+    namespace = COLLECTION_NAMESPACES[xml_format]
+    out.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+    out.write('<collection xmlns="%s">' % namespace if namespace else '<collection>')
+
+    counts = [0, 0]
+
+    def write(chunk, records):
+        out.write(''.join(records))
+        counts[0] += len(records)
+        counts[1] += sum(len(raw) for raw in chunk[3])
+        if progress is not None:
+            progress(counts[0], counts[1])
+
+    # pool_map keeps a bounded number of chunks in flight so a slow
+    # writer does not pull the whole file into memory
+    tasks = iter_chunks(raws, record_cls, raw_encoding, xml_format, chunk_size)
+    for chunk, records in pool_map(convert_chunk, tasks, processes):
+        write(chunk, records)
+
+    out.write('</collection>\n')
+    return counts[0]
@@ -1,21 +1,68 @@
 # encoding: utf-8
 
+from time import time, sleep
+import os
+
 import exc
+import iso2709
+import stats
+from compressed import open_source
+from indexer import parallel_index
+from constants import LEADER_LEN, END_OF_RECORD
+
+# size of the blocks read while looking for the next record terminator
+RESYNC_CHUNK_SIZE = 64 * 1024
+# iter_raw reads runs of records up to this size at once, so a BGZF source
+# can inflate their blocks in parallel
+READ_AHEAD_SIZE = 4 * 1024 * 1024
+
 
+def iter_stream(stream):
+    """
+    yields undecoded records from a stream that cannot seek (a pipe or
+    stdin), framing them by their length prefix
+    """
+    while True:
+        first5 = stream.read(5)
+        if not first5:
+            break
+        if len(first5) < 5 or not first5.isdigit() or int(first5) <= 5:
+            raise exc.RecordLengthInvalid
+        rest = stream.read(int(first5) - 5)
+        if len(rest) < int(first5) - 5:
+            raise exc.RecordLengthInvalid
+        yield first5 + rest
 
 
 class Reader(object):
-    def __init__(self, record_cls, source, raw_encoding='utf-8'):
+    def __init__(self, record_cls, source, raw_encoding='utf-8', recover=False, on_error=None, processes=None):
         """
         record_cls - record class
-        source - file or StringIO
+        source - file, StringIO or path; paths to gzip, bzip2, zstandard and
+            BGZF files are decompressed transparently
         raw_encoding - encoding of raw records
+        recover - skip damaged records instead of raising; every record must
+            end with END_OF_RECORD, otherwise the reader rescans forward to the
+            next terminator and continues from there
+        on_error - callable(offset, length) called for each skipped byte range
+            and for each record rejected by iter_verified
+        processes - worker processes inflating the blocks of a BGZF source
+            read by iter_raw
         """
+        # a source opened from a path is closed by close()
+        self.__owns_source = isinstance(source, basestring)
+        if self.__owns_source:
+            source = open_source(source, processes)
         self.__record_cls = record_cls
         self.__source = source
         self.__raw_encoding = raw_encoding
+        self.__recover = recover
+        self.__on_error = on_error
         self.__index = []
+        self.__bad_ranges = []
         self.__indexed = False
+        # end of the last indexed record
+        self.__end = 0
         self.__next = -1
 
     def __len__(self):
@@ -23,32 +70,321 @@ class Reader(object):
             self.__index_source()
         return len(self.__index)
 
-    def __index_source(self):
-        offset = 0
+    @property
+    def bad_ranges(self):
+        """
+        list of (offset, length) byte ranges skipped in recover mode
+        """
+        if not self.__indexed:
+            self.__index_source()
+        return self.__bad_ranges
+
+    def __index_source(self, tail=False):
+        """
+        indexes the records from the end of the indexed part of the source;
+        tail - stop quietly at an incomplete last record, which may still be
+            being appended
+        """
+        collector = stats.active
+        if collector is not None:
+            start = time()
+            begin = self.__end
+
+        try:
+            if self.__recover:
+                self.__index_source_recover(tail)
+            else:
+                self.__index_source_strict(tail)
+        except exc.PymarcException:
+            if collector is not None:
+                collector.error('reader.index')
+            raise
+        self.__indexed = True
+
+        if collector is not None:
+            collector.add('reader.index', time() - start, self.__end - begin)
+
+    def build_index(self, processes=None):
+        """
+        indexes the source with worker processes scanning byte ranges of
+        the file in parallel (see indexer); compressed and in-memory sources
+        and recover mode are indexed sequentially
+        """
+        if self.__indexed:
+            return
+        if self.__recover or not isinstance(self.__source, file):
+            self.__index_source()
+            return
+
+        collector = stats.active
+        if collector is not None:
+            start = time()
+        try:
+            self.__index, self.__end = parallel_index(self.__source.name, processes)
+        except exc.PymarcException:
+            if collector is not None:
+                collector.error('reader.index')
+            raise
+        self.__indexed = True
+        if collector is not None:
+            collector.add('reader.index', time() - start, self.__end)
+
+    def __complete(self, offset, length):
+        self.__source.seek(offset + length - 1)
+        return len(self.__source.read(1)) == 1
+
+    def __index_source_strict(self, tail):
+        offset = self.__end
+        self.__source.seek(offset)
         while True:
             first5 = self.__source.read(5)
 
             if not first5:
                 break
             if len(first5) < 5:
+                if tail:
+                    break
                 raise exc.RecordLengthInvalid
 
             length = int(first5)
+            if tail and not self.__complete(offset, length):
+                break
             self.__index.append((offset, length))
             offset += length
             self.__source.seek(offset)
 
-        self.__indexed = True
+        self.__end = offset
 
-    def next(self):
-        self.__next +=1
-        return self[self.__next]
+    def __index_source_recover(self, tail):
+        offset = self.__end
+        while True:
+            self.__source.seek(offset)
+            chunk = self.__source.read(5)
+            if not chunk:
+                break
 
+            length = 0
+            if len(chunk) == 5 and chunk.isdigit():
+                length = int(chunk)
 
-    def __getitem__(self, item):
+            if length > LEADER_LEN:
+                chunk += self.__source.read(length - 5)
+                if tail and len(chunk) < length:
+                    break
+                # the only terminator of a sound record is its last byte
+                if chunk.find(END_OF_RECORD) == length - 1:
+                    self.__index.append((offset, length))
+                    offset += length
+                    continue
+            elif tail and len(chunk) < 5:
+                break
+
+            position = self.__resync(offset, tail)
+            if position is None:
+                break
+            offset = position
+
+        self.__end = offset
+
+    def __resync(self, offset, tail=False):
+        """
+        scans forward from a damaged record at offset to the next
+        END_OF_RECORD, reports the skipped range and returns the offset
+        where reading should continue; in tail mode returns None when there
+        is no terminator yet
+        """
+        self.__source.seek(offset)
+        position = offset
+        while True:
+            chunk = self.__source.read(RESYNC_CHUNK_SIZE)
+            if not chunk:
+                if tail:
+                    return None
+                break
+            terminator = chunk.find(END_OF_RECORD)
+            if terminator != -1:
+                position += terminator + 1
+                break
+            position += len(chunk)
+
+        self.__bad_ranges.append((offset, position - offset))
+        if stats.active is not None:
+            stats.active.error('reader.index')
+        if self.__on_error is not None:
+            self.__on_error(offset, position - offset)
+        return position
+
+    def refresh(self):
+        """
+        indexes records appended to the source since it was last indexed,
+        scanning only the new bytes; an incomplete last record is left for
+        a later call. returns the number of new records
+        """
+        if not self.__indexed:
+            self.__index_source(tail=True)
+            return len(self.__index)
+        count = len(self.__index)
+        self.__index_source(tail=True)
+        return len(self.__index) - count
+
+    def follow(self, start=None, poll_interval=1.0, timeout=None):
+        """
+        yields records as they are appended to the source, like tail -f
+        start - first record number, by default only records appended later
+        poll_interval - seconds to wait when there is nothing new
+        timeout - stop after this many seconds without new records
+        """
+        self.refresh()
+        item = len(self.__index) if start is None else start
+        idle = 0.0
+        while True:
+            while item < len(self.__index):
+                yield self[item]
+                item += 1
+            if self.refresh():
+                idle = 0.0
+                continue
+            if timeout is not None and idle >= timeout:
+                return
+            sleep(poll_interval)
+            idle += poll_interval
+
+    @property
+    def record_cls(self):
+        return self.__record_cls
+
+    @property
+    def raw_encoding(self):
+        return self.__raw_encoding
+
+    def raw(self, item):
+        """
+        returns the undecoded record at position item
+        """
         if not self.__indexed:
             self.__index_source()
         offset, length = self.__index[item]
+        collector = stats.active
+        if collector is not None:
+            start = time()
         self.__source.seek(offset)
         chunk = self.__source.read(length)
-        return  self.__record_cls(chunk, self.__raw_encoding)
+        if collector is not None:
+            collector.add('reader.read', time() - start, len(chunk))
+        return chunk
+
+    def iter_raw(self):
+        """
+        yields undecoded records in file order, reading runs of records of
+        up to READ_AHEAD_SIZE bytes at once
+        """
+        if not self.__indexed:
+            self.__index_source()
+        index = self.__index
+        item = 0
+        while item < len(index):
+            first = index[item][0]
+            stop = item + 1
+            while stop < len(index) and index[stop][0] + index[stop][1] - first <= READ_AHEAD_SIZE:
+                stop += 1
+            last_offset, last_length = index[stop - 1]
+
+            collector = stats.active
+            if collector is not None:
+                start = time()
+            self.__source.seek(first)
+            chunk = self.__source.read(last_offset + last_length - first)
+            if collector is not None:
+                collector.add('reader.read', time() - start, len(chunk))
+
+            for offset, length in index[item:stop]:
+                yield chunk[offset - first:offset - first + length]
+            item = stop
+
+    def close(self):
+        """
+        closes the source if the reader opened it from a path
+        """
+        if self.__owns_source:
+            self.__source.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def iter_verified(self, quarantine=None):
+        """
+        yields (record number, undecoded record) for the records passing
+        iso2709.verify; the others are written to quarantine, if given, and
+        reported to on_error without being decoded
+        """
+        for item in xrange(len(self)):
+            raw = self.raw(item)
+            if not iso2709.verify(raw):
+                yield item, raw
+                continue
+            if stats.active is not None:
+                stats.active.error('reader.verify')
+            if quarantine is not None:
+                quarantine.write(raw)
+            if self.__on_error is not None:
+                self.__on_error(*self.__index[item])
+
+    def __source_size(self):
+        if isinstance(self.__source, file):
+            return os.fstat(self.__source.fileno()).st_size
+        return None
+
+    def save_index(self, out):
+        """
+        writes the offset index to out: a "# end <offset> size <bytes>"
+        line telling where indexing stopped, then one "offset length" line
+        per record
+        """
+        if not self.__indexed:
+            self.__index_source()
+        size = self.__source_size()
+        out.write('# end %d size %d\n' % (self.__end, size if size is not None else -1))
+        for offset, length in self.__index:
+            out.write('%d %d\n' % (offset, length))
+
+    def load_index(self, index_file, refresh=True):
+        """
+        uses an index written by save_index instead of scanning the source;
+        with refresh only the bytes appended since it was saved are scanned.
+        An index that does not fit the source (shorter file, no record
+        terminator at the saved end) is dropped and the source rescanned.
+        """
+        index = []
+        end = saved_size = None
+        for line in index_file:
+            if line.startswith('#'):
+                words = line.split()
+                end, saved_size = int(words[2]), int(words[4])
+                continue
+            offset, length = line.split()
+            index.append((int(offset), int(length)))
+        if end is None:
+            end = index[-1][0] + index[-1][1] if index else 0
+
+        size = self.__source_size()
+        valid = size is None or saved_size is None or saved_size < 0 or size >= saved_size
+        if valid and end:
+            self.__source.seek(end - 1)
+            valid = self.__source.read(1) == END_OF_RECORD
+
+        self.__index = index if valid else []
+        self.__end = end if valid else 0
+        self.__indexed = valid
+        if refresh:
+            self.refresh()
+
+    def next(self):
+        self.__next +=1
+        return self[self.__next]
+
+
+    def __getitem__(self, item):
+        return  self.__record_cls(self.raw(item), self.__raw_encoding)
@@ -1,26 +1,49 @@
 # encoding: utf-8
 from array import array
+from time import time
 import exc
-from marc8 import marc8_to_unicode
+import iso2709
+import stats
+from marc8 import decode_data
 from field import ControlField, DataField, Subfield, LinkedSubfield
+from storage import IndexedList
+from tables import TAGS, CHARS
+from fingerprint import fingerprint, match_key, match_fingerprint, VOLATILE_TAGS, \
+    MARC21_MATCH_KEY, UNIMARC_MATCH_KEY
 from constants import LEADER_LEN, DIRECTORY_ENTRY_LEN, SUBFIELD_INDICATOR, END_OF_FIELD, END_OF_RECORD
 
 class Record(object):
+    # subfields compared by match_key: title, author, date
+    MATCH_KEY = MARC21_MATCH_KEY
+
     def __init__(self, raw='', raw_encoding='utf-8'):
         self._leader = array('c', '          22        4500')
-        self._fields = {}
+        self._fields = IndexedList('tag')
         self.raw = raw
         self.raw_encoding = raw_encoding
 
     def __getitem__(self, item):
         return self.fields[item]
 
+    def __setitem__(self, item, fields):
+        self.fields[item] = fields
+
     def _load(self):
         """
         for lazy load
         """
         if self.raw:
-            self.decode(self.raw, self.raw_encoding)
+            collector = stats.active
+            if collector is None:
+                self.decode(self.raw, self.raw_encoding)
+            else:
+                start = time()
+                try:
+                    self.decode(self.raw, self.raw_encoding)
+                except Exception:
+                    collector.error('record.decode')
+                    raise
+                collector.add('record.decode', time() - start, len(self.raw))
             self.raw = None
 
     @property
@@ -42,6 +65,14 @@ class Record(object):
 
     @fields.setter
     def fields(self, value):
+        """
+        value - IndexedList, list of fields in record order or, as before,
+            dict of lists of fields by tag
+        """
+        if isinstance(value, dict):
+            value = [field for key in sorted(value.iterkeys()) for field in value[key]]
+        if not isinstance(value, IndexedList):
+            value = IndexedList('tag', value)
         self._fields = value
 
 
@@ -51,20 +82,97 @@ class Record(object):
             'controlfields': {},
             'datafields': {}
         }
-        for key in sorted(self.fields.iterkeys()):
-            for field in self._fields[key]:
-                if isinstance(field, ControlField):
-                    if field.tag not in record_dict['controlfields']:
-                        record_dict['controlfields'][field.tag] = []
-                    record_dict['controlfields'][field.tag].append(field.to_dict())
-                else:
-                    if field.tag not in record_dict['datafields']:
-                        record_dict['datafields'][field.tag] = []
-                    record_dict['datafields'][field.tag].append(field.to_dict())
+        for field in self.fields.ordered():
+            if isinstance(field, ControlField):
+                if field.tag not in record_dict['controlfields']:
+                    record_dict['controlfields'][field.tag] = []
+                record_dict['controlfields'][field.tag].append(field.to_dict())
+            else:
+                if field.tag not in record_dict['datafields']:
+                    record_dict['datafields'][field.tag] = []
+                record_dict['datafields'][field.tag].append(field.to_dict())
         return record_dict
 
+    def _patchable(self):
+        """
+        the record is still undecoded and its raw buffer can be patched
+        """
+        return bool(self.raw) and self.raw_encoding != 'marc8'
+
+    def replace_field(self, tag, field, occurrence=0):
+        """
+        puts field in place of the occurrence of tag
+
+        While the record is undecoded the change is spliced into self.raw:
+        only the new field is encoded and the directory and leader lengths
+        are adjusted, the bytes of all other fields stay untouched.
+        field must have the tag it replaces, otherwise ValueError is raised.
+        """
+        if field.tag != tag:
+            raise ValueError('tag %r does not belong under %r' % (field.tag, tag))
+        if self._patchable():
+            position = iso2709.find_field(self.raw, tag, occurrence)
+            if position is None:
+                raise exc.FieldNotFound
+            self.raw = iso2709.replace_field(self.raw, position, field.as_marc(self.raw_encoding))
+            return
+
+        positions = self.fields.positions(tag)
+        if occurrence >= len(positions):
+            raise exc.FieldNotFound
+        self._fields.replace(positions[occurrence], field)
+
+    def insert_field(self, field):
+        """
+        adds field after the fields with tags up to its own, patching
+        self.raw while the record is undecoded
+        """
+        if self._patchable():
+            self.raw = iso2709.insert_field(self.raw, str(field.tag), field.as_marc(self.raw_encoding))
+            return
+
+        fields = self.fields.ordered()
+        position = len(fields)
+        while position and fields[position - 1].tag > field.tag:
+            position -= 1
+        self._fields.insert(position, field)
+
+    def delete_field(self, tag, occurrence=0):
+        """
+        removes the occurrence of tag, patching self.raw while the record
+        is undecoded
+        """
+        if self._patchable():
+            position = iso2709.find_field(self.raw, tag, occurrence)
+            if position is None:
+                raise exc.FieldNotFound
+            self.raw = iso2709.delete_field(self.raw, position)
+            return
+
+        positions = self.fields.positions(tag)
+        if occurrence >= len(positions):
+            raise exc.FieldNotFound
+        self._fields.remove(self._fields.ordered()[positions[occurrence]])
+
+    def fingerprint(self, exclude=VOLATILE_TAGS):
+        """
+        64-bit hash of all fields but the excluded ones, independent of
+        field order
+        """
+        return fingerprint(self, exclude)
+
+    def match_key(self, spec=None):
+        """
+        normalized title, author and date (or spec) of the record
+        """
+        return match_key(self, spec or self.MATCH_KEY)
+
+    def match_fingerprint(self, spec=None):
+        return match_fingerprint(self.match_key(spec))
+
     def add_field(self, field):
-        self._fields[field.tag].append(field)
+        self._load()
+        self._fields.append(field)
 
 
     def decode(self, raw, raw_encoding):
@@ -102,7 +210,7 @@ class Record(object):
             entry_start = field_count * DIRECTORY_ENTRY_LEN
             entry_end = entry_start + DIRECTORY_ENTRY_LEN
             entry = directory[entry_start:entry_end]
-            entry_tag = entry[0:3]
+            entry_tag = TAGS.get(entry[0:3]) or unicode(entry[0:3])
             entry_length = int(entry[3:7])
             entry_offset = int(entry[7:12])
             entry_data = raw[base_address + entry_offset:
@@ -110,39 +218,22 @@ class Record(object):
 
             # assume controlfields are numeric; replicates ruby-marc behavior
             if entry_tag < '010' and entry_tag.isdigit():
-                if raw_encoding == 'marc8':
-                    data = marc8_to_unicode(entry_data)
-                else:
-                    data = entry_data.decode(raw_encoding)
-                field = ControlField(tag=entry_tag, data=data)
+                field = ControlField._from_decoded(entry_tag, decode_data(entry_data, raw_encoding))
             else:
                 subfields = []
                 subs = entry_data.split(SUBFIELD_INDICATOR)
-                ind1 = subs[0][0]
-                ind2 = subs[0][1]
+                ind1 = CHARS.get(subs[0][0]) or unicode(subs[0][0])
+                ind2 = CHARS.get(subs[0][1]) or unicode(subs[0][1])
                 for subfield in subs[1:]:
                     if len(subfield) == 0:
                         continue
-                    code = subfield[0]
+                    code = CHARS.get(subfield[0]) or unicode(subfield[0])
                     data = subfield[1:]
 
-                    if raw_encoding == 'marc8':
-                        data = marc8_to_unicode(data)
-                    else:
-                        data = data.decode(raw_encoding)
-
-                    subfields.append(Subfield(code=code, data=data))
-
-                field = DataField(
-                    tag=entry_tag,
-                    ind1=ind1,
-                    ind2=ind2,
-                    subfields=subfields,
-                )
-            if field.tag not in self._fields:
-                self._fields[field.tag] = []
+                    subfields.append(Subfield._from_decoded(code, decode_data(data, raw_encoding)))
 
-            self._fields[field.tag].append(field)
+                field = DataField._from_decoded(entry_tag, ind1, ind2, subfields)
+            self._fields.append(field)
             field_count += 1
 
         if field_count == 0:
@@ -153,7 +244,11 @@ class Record(object):
         returns the record serialized as MARC21
         """
         self._load()
+        if stats.active is None:
+            return self._as_marc(to_encoding)
+        return stats.measure('record.as_marc', self._as_marc, (to_encoding, ))
 
+    def _as_marc(self, to_encoding):
         fields = []
         directory = []
         offset = 0
@@ -164,13 +259,12 @@ class Record(object):
         # each element of the directory includes the tag, the byte length of
         # the field and the offset from the base address where the field data
         # can be found
-        for key in sorted(self._fields.iterkeys()):
-            for field in self._fields[key]:
-                field_data = field.as_marc(to_encoding)
-                fields.append(field_data)
-                directory.append('%03d' % int(field.tag))
-                directory.append('%04d%05d' % (len(field_data), offset))
-                offset += len(field_data)
+        for field in self._fields.ordered():
+            field_data = field.as_marc(to_encoding)
+            fields.append(field_data)
+            directory.append('%03d' % int(field.tag))
+            directory.append('%04d%05d' % (len(field_data), offset))
+            offset += len(field_data)
 
 
         # directory ends with an end of field
@@ -199,9 +293,8 @@ class Record(object):
     def __unicode__(self):
         self._load()
         lines = [self._leader.tostring().replace(' ', '#')]
-        for key in sorted(self._fields.iterkeys()):
-            for field in self._fields[key]:
-                lines.append(unicode(field))
+        for field in self._fields.ordered():
+            lines.append(unicode(field))
         return u'\n'.join(lines)
 
     def __str__(self):
@@ -209,15 +302,16 @@ class Record(object):
 
 
 class UnimarcRecord(Record):
+    MATCH_KEY = UNIMARC_MATCH_KEY
+
     def __init__(self, raw='', raw_encoding='utf-8'):
         super(UnimarcRecord, self).__init__(raw, raw_encoding)
 
     def __unicode__(self):
         self._load()
         lines = [self._leader.tostring().replace(' ', '#')]
-        for key in sorted(self._fields.iterkeys()):
-            for field in self._fields[key]:
-                lines.append(unicode(field))
+        for field in self._fields.ordered():
+            lines.append(unicode(field))
         return u'\n'.join(lines)
 
     def __str__(self):
@@ -259,7 +353,7 @@ class UnimarcRecord(Record):
             entry_start = field_count * DIRECTORY_ENTRY_LEN
             entry_end = entry_start + DIRECTORY_ENTRY_LEN
             entry = directory[entry_start:entry_end]
-            entry_tag = entry[0:3]
+            entry_tag = TAGS.get(entry[0:3]) or unicode(entry[0:3])
             entry_length = int(entry[3:7])
             entry_offset = int(entry[7:12])
             entry_data = raw[base_address + entry_offset:
@@ -267,86 +361,56 @@ class UnimarcRecord(Record):
 
             # assume controlfields are numeric; replicates ruby-marc behavior
             if entry_tag < '010' and entry_tag.isdigit():
-                if raw_encoding == 'marc8':
-                    data = marc8_to_unicode(entry_data)
-                else:
-                    data = entry_data.decode(raw_encoding)
-                field = ControlField(tag=entry_tag, data=data)
+                field = ControlField._from_decoded(entry_tag, decode_data(entry_data, raw_encoding))
             else:
                 subfields = []
                 subs = entry_data.split(SUBFIELD_INDICATOR)
-                ind1 = subs[0][0]
-                ind2 = subs[0][1]
+                ind1 = CHARS.get(subs[0][0]) or unicode(subs[0][0])
+                ind2 = CHARS.get(subs[0][1]) or unicode(subs[0][1])
 
                 #########################################################################
                 if entry_tag > '399' and entry_tag < '500':
-                    linked_subfield = None
-                    start_linked_parse = False # flag of begining linked subfield parse
+                    # raw pieces of the linked field being collected; they are
+                    # decoded only when LinkedSubfield.field is accessed
+                    linked = None
                     for subfield in subs[1:]:
-                        code = subfield[0]
+                        if len(subfield) == 0:
+                            continue
+                        code = CHARS.get(subfield[0]) or unicode(subfield[0])
                         data = subfield[1:]
                         if code == '1':
-                            start_linked_parse = True # begin parse linked subfield
-                            if linked_subfield:
-                                subfields.append(linked_subfield)
-
-                            linked_subfield = LinkedSubfield(code=code)
-                            linked_field_tag = data[0:3]
-                            if linked_field_tag < '010':
-                                if raw_encoding == 'marc8':
-                                    data = marc8_to_unicode(data)
-                                else:
-                                    data = data.decode(raw_encoding)
-                                linked_subfield.field = ControlField(linked_field_tag, data.decode(raw_encoding))
-                            else:
-                                linked_subfield.field = DataField(tag=linked_field_tag, ind1=data[3], ind2=data[4])
-
-                        elif start_linked_parse: # if now parse linked subfield
-                            if raw_encoding == 'marc8':
-                                data = marc8_to_unicode(data)
-                            else:
-                                data = data.decode(raw_encoding)
-                            linked_subfield.field.add_subfield(Subfield(code, data))
+                            if linked is not None:
+                                subfields.append(LinkedSubfield(code, raw=SUBFIELD_INDICATOR.join(linked),
+                                                                raw_encoding=raw_encoding))
+                            linked = [data]
+                        elif linked is not None: # if now parse linked subfield
+                            linked.append(subfield)
                         else: # if field with 4.. code but not have "1" linked subfield
-                            if raw_encoding == 'marc8':
-                                data = marc8_to_unicode(data)
-                            else:
-                                try:
-                                    data = data.decode(raw_encoding)
-                                except UnicodeDecodeError:
-                                    data = u"Can't decode field data"
-                            subfields.append(Subfield(code=code, data=data))
-
-                    if start_linked_parse:
-                        subfields.append(linked_subfield)
-                        start_linked_parse = False # now set flag that linked field stop parse
+                            try:
+                                data = decode_data(data, raw_encoding)
+                            except UnicodeDecodeError:
+                                data = u"Can't decode field data"
+                            subfields.append(Subfield._from_decoded(code, data))
+
+                    if linked is not None:
+                        subfields.append(LinkedSubfield('1', raw=SUBFIELD_INDICATOR.join(linked),
+                                                        raw_encoding=raw_encoding))
                 ##########################################################################
                 else:
                     for subfield in subs[1:]:
                         if len(subfield) == 0:
                             continue
-                        code = subfield[0]
+                        code = CHARS.get(subfield[0]) or unicode(subfield[0])
                         data = subfield[1:]
 
-                        if raw_encoding == 'marc8':
-                            data = marc8_to_unicode(data)
-                        else:
-                            try:
-                                data = data.decode(raw_encoding)
-                            except UnicodeDecodeError:
-                                data = u"Can't decode field data"
-                        subfields.append(Subfield(code=code, data=data))
-
-                field = DataField(
-                    tag=entry_tag,
-                    ind1=ind1,
-                    ind2=ind2,
-                    subfields=subfields,
-                )
-            if field.tag not in self._fields:
-                self._fields[field.tag] = []
-
-            self._fields[field.tag].append(field)
+                        try:
+                            data = decode_data(data, raw_encoding)
+                        except UnicodeDecodeError:
+                            data = u"Can't decode field data"
+                        subfields.append(Subfield._from_decoded(code, data))
+
+                field = DataField._from_decoded(entry_tag, ind1, ind2, subfields)
+            self._fields.append(field)
             field_count += 1
 
         if field_count == 0:
@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""
+record batches in shared memory for multi-process consumers
+
+    def title_length(batch, i):
+        return len(batch.decode(i, UnimarcRecord)['200'][0]['a'][0].data)
+
+    pool = BatchPool(title_length, processes=4)
+    for length in pool.map(Reader(UnimarcRecord, 'dump.mrc')):
+        ...
+
+A fixed ring of batches is allocated with multiprocessing.sharedctypes
+before the workers start, so they inherit it instead of receiving pickled
+records. The parent copies a run of raw records, found through the Reader
+offset index, into a free batch together with their offset table; workers
+get only the batch number and decode or scan the records in place. The
+functions they run are inherited the same way and need not be picklable.
+"""
+from collections import deque
+from multiprocessing import cpu_count
+from multiprocessing.sharedctypes import RawArray, RawValue
+
+import workers
+from workers import start_pool, ordered_map
+
+
+class RecordBatch(object):
+    def __init__(self, capacity=4 * 1024 * 1024, max_records=10000):
+        """
+        capacity - bytes of raw records the batch holds
+        max_records - records the batch holds
+        """
+        self.data = RawArray('c', capacity)
+        self.offsets = RawArray('l', max_records + 1)
+        self.count = RawValue('l', 0)
+        self.first = RawValue('l', 0)
+
+    def fill(self, reader, start, stop):
+        """
+        copies records start, start + 1, ... of reader until the batch or
+        stop is reached; returns the number of copied records
+        """
+        capacity = len(self.data)
+        max_records = len(self.offsets) - 1
+        position = 0
+        count = 0
+        self.offsets[0] = 0
+        for item in xrange(start, stop):
+            if count == max_records:
+                break
+            raw = reader.raw(item)
+            if position + len(raw) > capacity:
+                break
+            self.data[position:position + len(raw)] = raw
+            position += len(raw)
+            count += 1
+            self.offsets[count] = position
+        self.count.value = count
+        self.first.value = start
+        return count
+
+    def __len__(self):
+        return self.count.value
+
+    def item(self, i):
+        """
+        record number of the i-th record of the batch in the Reader
+        """
+        return self.first.value + i
+
+    def view(self, i):
+        """
+        read-only buffer of the i-th raw record, without copying
+        """
+        start = self.offsets[i]
+        return buffer(self.data, start, self.offsets[i + 1] - start)
+
+    def raw(self, i):
+        return str(self.view(i))
+
+    def decode(self, i, record_cls, raw_encoding='utf-8'):
+        return record_cls(self.raw(i), raw_encoding)
+
+
+def _run(slot):
+    batches, func = workers.state
+    batch = batches[slot]
+    return [func(batch, i) for i in xrange(len(batch))]
+
+
+class BatchPool(object):
+    def __init__(self, func, processes=None, slots=None, capacity=4 * 1024 * 1024, max_records=10000):
+        """
+        func - callable(batch, i) run in the workers for every record
+        processes - worker processes, cpu count if None
+        slots - batches in the ring, twice the processes if None
+        capacity, max_records - size of each batch
+        """
+        processes = processes or cpu_count()
+        self._batches = [RecordBatch(capacity, max_records) for i in xrange(slots or processes * 2)]
+        self._pool = start_pool(processes, (self._batches, func))
+
+    def map(self, reader):
+        """
+        yields func(batch, i) for every record of reader, in order
+        """
+        free = deque(xrange(len(self._batches)))
+        total = len(reader)
+
+        def slots():
+            # ordered_map takes the next slot only once the oldest result
+            # has been consumed and its slot freed below
+            item = 0
+            while item < total:
+                slot = free.popleft()
+                filled = self._batches[slot].fill(reader, item, total)
+                if not filled:
+                    raise ValueError('record %d does not fit into a batch' % item)
+                item += filled
+                yield slot
+
+        for slot, values in ordered_map(self._pool, _run, slots(), len(self._batches)):
+            for value in values:
+                yield value
+            free.append(slot)
+
+    def close(self):
+        self._pool.close()
+        self._pool.join()
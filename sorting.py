@@ -0,0 +1,103 @@
+# encoding: utf-8
+"""
+external sort of ISO 2709 files
+
+    sort_records(Reader(UnimarcRecord, 'dump.mrc'), open('sorted.mrc', 'wb'),
+                 subfield_key('100', 'a', 9, 13))
+
+Only (key, record number) pairs are sorted. They are spilled to temporary
+runs of max_keys pairs and merged, and the raw records are then copied to
+the output in key order through the Reader offset index, never re-encoded.
+Key functions get the raw record and should look only at the fields they
+need; their keys may be any picklable, comparable values.
+"""
+import cPickle as pickle
+import heapq
+import tempfile
+
+from iso2709 import iter_fields, iter_subfields
+
+
+def control_field_key(tag='001'):
+    """
+    key of the first tag field data, '' if the record has none
+    """
+    tags = frozenset([tag])
+
+    def key(raw):
+        for field_tag, data in iter_fields(raw, tags):
+            return data
+        return ''
+    return key
+
+
+def subfield_key(tag, code, start=None, stop=None):
+    """
+    key of the first tag$code subfield, optionally sliced [start:stop]
+    (e.g. subfield_key('100', 'a', 9, 13) is the UNIMARC date 1)
+    """
+    tags = frozenset([tag])
+
+    def key(raw):
+        for field_tag, data in iter_fields(raw, tags):
+            for sub_code, value in iter_subfields(data):
+                if sub_code == code:
+                    return value[start:stop]
+        return ''
+    return key
+
+
+def record_key(func, record_cls, raw_encoding='utf-8'):
+    """
+    key computed by func(record) on the decoded record, for keys that can
+    not be taken from raw fields
+    """
+    def key(raw):
+        return func(record_cls(raw, raw_encoding))
+    return key
+
+
+def _spill(pairs, tmpdir):
+    run = tempfile.TemporaryFile(dir=tmpdir)
+    for pair in pairs:
+        pickle.dump(pair, run, pickle.HIGHEST_PROTOCOL)
+    run.seek(0)
+    return run
+
+
+def _iter_run(run):
+    while True:
+        try:
+            yield pickle.load(run)
+        except EOFError:
+            run.close()
+            return
+
+
+def sort_records(reader, out, key, max_keys=1000000, tmpdir=None):
+    """
+    writes the raw records of reader to out ordered by key(raw)
+    max_keys - key pairs held in memory before a run is spilled to disk
+    tmpdir - directory of the spilled runs
+    ties keep their original order; returns the number of records
+    """
+    runs = []
+    pairs = []
+    for item in xrange(len(reader)):
+        pairs.append((key(reader.raw(item)), item))
+        if len(pairs) >= max_keys:
+            pairs.sort()
+            runs.append(_spill(pairs, tmpdir))
+            pairs = []
+    pairs.sort()
+
+    if runs:
+        merged = heapq.merge(*([_iter_run(run) for run in runs] + [iter(pairs)]))
+    else:
+        merged = pairs
+
+    count = 0
+    for sort_key, item in merged:
+        out.write(reader.raw(item))
+        count += 1
+    return count
@@ -0,0 +1,95 @@
+# encoding: utf-8
+"""
+optional instrumentation of the hot paths
+
+Instrumentation is off until a collector is installed:
+
+    import stats
+    collector = stats.enable()
+    ...
+    print collector.snapshot()
+    stats.disable()
+
+While off every instrumented call only checks that stats.active is None.
+"""
+from collections import defaultdict
+from time import time
+
+# the installed collector, None when instrumentation is off
+active = None
+
+
+class Stats(object):
+    def __init__(self, callback=None):
+        """
+        callback - callable(name, seconds, bytes, error=False) called for
+            every event, e.g. to feed a metrics system; failures are passed
+            as callback(name, None, 0, error=True)
+        """
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        self.counts = defaultdict(int)
+        self.seconds = defaultdict(float)
+        self.bytes = defaultdict(int)
+        self.errors = defaultdict(int)
+
+    def add(self, name, seconds, nbytes=0):
+        self.counts[name] += 1
+        self.seconds[name] += seconds
+        self.bytes[name] += nbytes
+        if self.callback is not None:
+            self.callback(name, seconds, nbytes)
+
+    def error(self, name):
+        self.errors[name] += 1
+        if self.callback is not None:
+            self.callback(name, None, 0, error=True)
+
+    def snapshot(self):
+        """
+        returns {name: {'count', 'seconds', 'bytes', 'errors'}}
+        """
+        names = set(self.counts) | set(self.errors)
+        return dict((name, {
+            'count': self.counts.get(name, 0),
+            'seconds': self.seconds.get(name, 0.0),
+            'bytes': self.bytes.get(name, 0),
+            'errors': self.errors.get(name, 0),
+        }) for name in names)
+
+
+def measure(name, func, args, nbytes=None):
+    """
+    calls func(*args) and records it under name in the active collector,
+    counting an error instead if it raises
+    nbytes - bytes handled, by default the length of a string result
+    """
+    collector = active
+    if collector is None:
+        return func(*args)
+    start = time()
+    try:
+        result = func(*args)
+    except Exception:
+        collector.error(name)
+        raise
+    if nbytes is None:
+        nbytes = len(result) if isinstance(result, str) else 0
+    collector.add(name, time() - start, nbytes)
+    return result
+
+
+def enable(collector=None):
+    """
+    installs collector (a new Stats if None) and returns it
+    """
+    global active
+    active = collector if collector is not None else Stats()
+    return active
+
+
+def disable():
+    global active
+    active = None
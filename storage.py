@@ -0,0 +1,263 @@
+# encoding: utf-8
+
+
+class IndexedList(object):
+    """
+    items kept in their original order plus an index of positions by the
+    key attribute of the items (tag for fields, code for subfields)
+
+    Lookups by key behave like the dict of lists used before:
+    fields['200'] returns a live KeyView of the 200 fields, so
+    fields['200'].append(field) and fields['200'] = [...] change the
+    record. A key assigned explicitly stays a key while it has no items, as
+    fields['997'] = [] does in a dict, until it is deleted. The index is
+    built on the first lookup, so code that only walks ordered() never pays
+    for it.
+    """
+    def __init__(self, key, items=None):
+        self._key = key
+        self._items = list(items) if items else []
+        self._index = None
+        # keys given by __setitem__, in order of assignment
+        self._assigned = []
+
+    def _build_index(self):
+        index = {}
+        key = self._key
+        for position, item in enumerate(self._items):
+            value = getattr(item, key)
+            if value in index:
+                index[value].append(position)
+            else:
+                index[value] = [position]
+        self._index = index
+
+    def positions(self, key):
+        """
+        returns positions of items with key in ordered()
+        """
+        if self._index is None:
+            self._build_index()
+        return self._index.get(key, [])
+
+    def ordered(self):
+        """
+        returns all items in their original order
+        """
+        return self._items
+
+    def append(self, item):
+        if self._index is not None:
+            key = getattr(item, self._key)
+            if key in self._index:
+                self._index[key].append(len(self._items))
+            else:
+                self._index[key] = [len(self._items)]
+        self._items.append(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def insert(self, position, item):
+        self._items.insert(position, item)
+        self._index = None
+
+    def replace(self, position, item):
+        """
+        puts item in place of the item at position
+        """
+        self._items[position] = item
+        self._index = None
+
+    def remove(self, item):
+        for position, candidate in enumerate(self._items):
+            if candidate is item:
+                del self._items[position]
+                self._index = None
+                return
+        raise ValueError('item not in list')
+
+    def clear(self):
+        del self._items[:]
+        del self._assigned[:]
+        self._index = None
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return KeyView(self, key)
+
+    def __setitem__(self, key, items):
+        """
+        replaces the items with key by items, which take the place of the
+        first of them or go to the end
+        """
+        items = list(items)
+        for item in items:
+            _check_key(self._key, key, item)
+        if key not in self._assigned:
+            self._assigned.append(key)
+        positions = self.positions(key)
+        if not positions:
+            self._items.extend(items)
+        else:
+            first = positions[0]
+            remaining = [item for item in self._items[first:] if getattr(item, self._key) != key]
+            self._items[first:] = items + remaining
+        self._index = None
+
+    def setdefault(self, key, default=None):
+        """
+        returns the KeyView of key, assigning it the items of default (none
+        if None) first if it is not a key yet
+        """
+        if key not in self:
+            self[key] = default or []
+        return KeyView(self, key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        if key in self._assigned:
+            self._assigned.remove(key)
+        self._items = [item for item in self._items if getattr(item, self._key) != key]
+        self._index = None
+
+    def __contains__(self, key):
+        return bool(self.positions(key)) or key in self._assigned
+
+    def get(self, key, default=None):
+        if key in self:
+            return KeyView(self, key)
+        return default
+
+    def iterkeys(self):
+        """
+        yields distinct keys in order of first appearance, then the
+        assigned keys without items
+        """
+        seen = set()
+        key = self._key
+        for item in self._items:
+            value = getattr(item, key)
+            if value not in seen:
+                seen.add(value)
+                yield value
+        for value in self._assigned:
+            if value not in seen:
+                yield value
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def itervalues(self):
+        for key in self.iterkeys():
+            yield self[key]
+
+    def values(self):
+        return list(self.itervalues())
+
+    def iteritems(self):
+        for key in self.iterkeys():
+            yield key, self[key]
+
+    def items(self):
+        return list(self.iteritems())
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        """
+        number of distinct keys, as for the dict of lists
+        """
+        if self._index is None:
+            self._build_index()
+        return len(self._index) + len([key for key in self._assigned if key not in self._index])
+
+
+def _check_key(attribute, key, item):
+    if getattr(item, attribute) != key:
+        raise ValueError('%s %r does not belong under %r' % (attribute, getattr(item, attribute), key))
+
+
+class KeyView(object):
+    """
+    live list of the items of an IndexedList with one key; reads follow the
+    IndexedList and changes are made in it
+    """
+    def __init__(self, indexed, key):
+        self._indexed = indexed
+        self._key = key
+
+    def _positions(self):
+        return self._indexed.positions(self._key)
+
+    def _list(self):
+        items = self._indexed.ordered()
+        return [items[position] for position in self._positions()]
+
+    def __len__(self):
+        return len(self._positions())
+
+    def __iter__(self):
+        return iter(self._list())
+
+    def __getitem__(self, index):
+        return self._list()[index]
+
+    def __setitem__(self, index, item):
+        _check_key(self._indexed._key, self._key, item)
+        self._indexed.replace(self._positions()[index], item)
+
+    def __delitem__(self, index):
+        self._indexed.remove(self._list()[index])
+
+    def append(self, item):
+        """
+        adds item after the last item of the whole list, as add_field does
+        """
+        _check_key(self._indexed._key, self._key, item)
+        self._indexed.append(item)
+
+    def extend(self, items):
+        for item in items:
+            self.append(item)
+
+    def insert(self, index, item):
+        _check_key(self._indexed._key, self._key, item)
+        positions = self._positions()
+        if index < len(positions):
+            self._indexed.insert(positions[index], item)
+        else:
+            self._indexed.append(item)
+
+    def remove(self, item):
+        for candidate in self._list():
+            if candidate == item:
+                self._indexed.remove(candidate)
+                return
+        raise ValueError('item not in list')
+
+    def index(self, item):
+        return self._list().index(item)
+
+    def count(self, item):
+        return self._list().count(item)
+
+    def __contains__(self, item):
+        return item in self._list()
+
+    def __eq__(self, other):
+        if isinstance(other, KeyView):
+            other = other._list()
+        return self._list() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self._list())
@@ -0,0 +1,16 @@
+# encoding: utf-8
+"""
+shared unicode objects for tags, indicators and subfield codes
+
+A large collection holds millions of fields and subfields but only a few
+hundred distinct tags and codes. Looking them up here instead of calling
+unicode() gives every field the same object for the same value; keys are
+byte strings, which also find unicode ones.
+"""
+
+# '000' .. '999'
+TAGS = dict(('%03d' % number, unicode('%03d' % number)) for number in xrange(1000))
+
+# single ascii characters: indicators and subfield codes
+CHARS = dict((chr(number), unicode(chr(number))) for number in xrange(128))
+
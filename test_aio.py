@@ -0,0 +1,129 @@
+# encoding: utf-8
+"""
+tests of the asyncio reader and writer against in-memory streams
+
+    python -m unittest test_aio
+"""
+import unittest
+from StringIO import StringIO
+
+import trollius as asyncio
+from trollius import From
+
+import exc
+from aio import AsyncReader, AsyncWriter
+from bench import CorpusGenerator
+from field import ControlField
+from reader import Reader
+from record import UnimarcRecord
+
+
+class FakeWriter(object):
+    """
+    the part of asyncio.StreamWriter AsyncWriter uses
+    """
+    def __init__(self):
+        self.data = []
+        self.closed = False
+
+    def write(self, data):
+        self.data.append(data)
+
+    @asyncio.coroutine
+    def drain(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class AsyncTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        corpus = CorpusGenerator('unimarc', linked=1).corpus(20)
+        self.raws = list(Reader(UnimarcRecord, StringIO(corpus)).iter_raw())
+
+    def tearDown(self):
+        self.loop.close()
+
+    def run_loop(self, coroutine):
+        return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5, loop=self.loop))
+
+    def test_read_all(self):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(''.join(self.raws))
+        stream.feed_eof()
+        reader = AsyncReader(UnimarcRecord, stream, max_pending=4, loop=self.loop)
+
+        @asyncio.coroutine
+        def read_all():
+            records = []
+            while True:
+                record = yield From(reader.read())
+                if record is None:
+                    break
+                records.append(record.as_marc())
+            raise asyncio.Return(records)
+
+        self.assertEqual(self.run_loop(read_all()),
+                         [UnimarcRecord(raw).as_marc() for raw in self.raws])
+
+    def test_record_is_not_held_back(self):
+        # a live stream: only the first record has arrived and nothing else
+        # will until it is answered
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(self.raws[0])
+        reader = AsyncReader(UnimarcRecord, stream, max_pending=8, loop=self.loop)
+        record = self.run_loop(reader.read())
+        self.assertEqual(record.as_marc(), UnimarcRecord(self.raws[0]).as_marc())
+
+        stream.feed_data(self.raws[1])
+        stream.feed_eof()
+        self.assertEqual(self.run_loop(reader.read()).as_marc(), UnimarcRecord(self.raws[1]).as_marc())
+        self.assertIsNone(self.run_loop(reader.read()))
+
+    def test_truncated_record(self):
+        stream = asyncio.StreamReader(loop=self.loop)
+        stream.feed_data(self.raws[0] + self.raws[1][:100])
+        stream.feed_eof()
+        reader = AsyncReader(UnimarcRecord, stream, loop=self.loop)
+        self.assertIsNotNone(self.run_loop(reader.read()))
+        self.assertRaises(exc.RecordLengthInvalid, self.run_loop, reader.read())
+
+    def test_write(self):
+        out = FakeWriter()
+        writer = AsyncWriter(out, max_pending=3, loop=self.loop)
+
+        @asyncio.coroutine
+        def write_all():
+            for raw in self.raws:
+                yield From(writer.write(UnimarcRecord(raw)))
+            yield From(writer.close())
+
+        self.run_loop(write_all())
+        self.assertTrue(out.closed)
+        self.assertEqual(out.data, [UnimarcRecord(raw).as_marc() for raw in self.raws])
+
+    def test_write_takes_the_record_as_it_is(self):
+        out = FakeWriter()
+        writer = AsyncWriter(out, max_pending=8, loop=self.loop)
+        undecoded = UnimarcRecord(self.raws[0])
+        decoded = UnimarcRecord(self.raws[1])
+        decoded._load()
+        leader = decoded.leader.tostring()
+        expected = [UnimarcRecord(raw).as_marc() for raw in self.raws[:2]]
+
+        @asyncio.coroutine
+        def write_and_change():
+            for record in (undecoded, decoded):
+                yield From(writer.write(record))
+                record.add_field(ControlField('005', u'20990101000000.0'))
+            yield From(writer.flush())
+
+        self.run_loop(write_and_change())
+        self.assertEqual(out.data, expected)
+        self.assertEqual(decoded.leader.tostring(), leader)
+
+
+if __name__ == '__main__':
+    unittest.main()
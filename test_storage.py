@@ -0,0 +1,62 @@
+# encoding: utf-8
+"""
+tests of the dict of lists idioms on record fields and field subfields
+
+    python -m unittest test_storage
+"""
+import unittest
+
+from field import ControlField, DataField, Subfield
+from record import Record
+
+
+class FieldsTest(unittest.TestCase):
+    def test_assign_empty_then_append(self):
+        record = Record()
+        record.add_field(ControlField('001', u'1'))
+        field = DataField('997', [Subfield('a', u'x')])
+        if '997' not in record.fields:
+            record.fields['997'] = []
+        self.assertIn('997', record.fields)
+        self.assertEqual(len(record.fields['997']), 0)
+        record.fields['997'].append(field)
+        self.assertEqual(list(record['997']), [field])
+        self.assertEqual(record.fields.keys(), [u'001', u'997'])
+
+    def test_assigned_key_stays_until_deleted(self):
+        record = Record()
+        record.fields['997'] = []
+        self.assertEqual(record.fields.keys(), ['997'])
+        self.assertEqual(len(record.fields), 1)
+        del record.fields['997']
+        self.assertNotIn('997', record.fields)
+        self.assertRaises(KeyError, lambda: record.fields['997'])
+
+    def test_setdefault(self):
+        record = Record()
+        field = DataField('997', [Subfield('a', u'x')])
+        record.fields.setdefault('997', []).append(field)
+        self.assertEqual(list(record['997']), [field])
+
+
+class SubfieldsTest(unittest.TestCase):
+    def test_assign_empty_then_append(self):
+        field = DataField('200', [Subfield('b', u'y')])
+        subfield = Subfield('a', u'x')
+        if 'a' not in field.subfields:
+            field.subfields['a'] = []
+        field['a'].append(subfield)
+        self.assertEqual(list(field['a']), [subfield])
+        self.assertEqual(field.subfields.keys(), [u'b', u'a'])
+
+    def test_setitem_empty(self):
+        field = DataField('200', [Subfield('a', u'x')])
+        field['a'] = []
+        self.assertIn('a', field.subfields)
+        self.assertEqual(len(field['a']), 0)
+        field['a'].append(Subfield('a', u'z'))
+        self.assertEqual([subfield.data for subfield in field['a']], [u'z'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,276 @@
+# encoding: utf-8
+"""
+record validation against MARC21 and RUSMARC structure rules
+
+    rules = RuleSet(RUSMARC_RULES)
+    for violation in validate(Reader(UnimarcRecord, 'dump.mrc'), rules, processes=4):
+        print violation
+
+A rule set is written as plain data (see MARC21_RULES) and compiled once
+into sets and dicts keyed by tag. Records are checked raw: only the leader,
+the directory, indicators and subfield codes are looked at, and subfield
+data only for fixed-length subfields, which hold ascii codes and are
+compared as bytes, so nothing is decoded. Each problem becomes a Violation
+naming the record number, the rule and where it was found.
+
+Rule set keys:
+    leader - {position: allowed characters}
+    mandatory - tags every record must have
+    fields - {tag: field rule}, a field rule has the optional keys
+        repeatable - False if the tag may occur once only
+        ind1, ind2 - allowed indicator characters
+        subfields - allowed subfield codes
+        fixed - {code or None for control field data:
+                 (length or None, {position: allowed characters})}
+"""
+import workers
+from constants import LEADER_LEN
+from iso2709 import iter_fields, iter_subfields, verify, DIRECTORY_ERRORS
+from workers import chunks, pool_map
+
+MARC21_RULES = {
+    'leader': {
+        5: 'acdnp',
+        6: 'acdefgijkmoprt',
+        7: 'abcdims',
+        8: ' a',
+        9: ' a',
+        10: '2',
+        11: '2',
+        17: ' 1234578uz',
+        18: ' acinu',
+        19: ' abc',
+        20: '4',
+        21: '5',
+        22: '0',
+        23: '0',
+    },
+    'mandatory': ['001', '008', '245'],
+    'fields': {
+        '001': {'repeatable': False},
+        '003': {'repeatable': False},
+        '005': {'repeatable': False, 'fixed': {None: (16, {})}},
+        '008': {'repeatable': False, 'fixed': {None: (40, {6: 'bcdeikmnpqrstu|', 38: ' dorsx|', 39: ' cdu|'})}},
+        '010': {'repeatable': False, 'ind1': ' ', 'ind2': ' ', 'subfields': 'abz8'},
+        '020': {'ind1': ' ', 'ind2': ' ', 'subfields': 'acqz68'},
+        '040': {'repeatable': False, 'ind1': ' ', 'ind2': ' ', 'subfields': 'abcde68'},
+        '100': {'repeatable': False, 'ind1': '013', 'ind2': ' ', 'subfields': 'abcdefgjklnpqtu0124568'},
+        '110': {'repeatable': False, 'ind1': '012', 'ind2': ' ', 'subfields': 'abcdefgklnptu0124568'},
+        '111': {'repeatable': False, 'ind1': '012', 'ind2': ' ', 'subfields': 'acdefgjklnpqtu0124568'},
+        '130': {'repeatable': False, 'ind1': '0123456789', 'ind2': ' ', 'subfields': 'adfghklmnoprst012678'},
+        '240': {'repeatable': False, 'ind1': '01', 'ind2': '0123456789', 'subfields': 'adfghklmnoprs012678'},
+        '245': {'repeatable': False, 'ind1': '01', 'ind2': '0123456789', 'subfields': 'abcfghknps68'},
+        '250': {'ind1': ' ', 'ind2': ' ', 'subfields': 'ab368'},
+        '260': {'ind1': ' 23', 'ind2': ' ', 'subfields': 'abcefg3678'},
+        '264': {'ind1': ' 23', 'ind2': '01234', 'subfields': 'abc3678'},
+        '300': {'ind1': ' ', 'ind2': ' ', 'subfields': 'abcefg35678'},
+        '490': {'ind1': '01', 'ind2': ' ', 'subfields': 'alvx3678'},
+        '500': {'ind1': ' ', 'ind2': ' ', 'subfields': 'a35678'},
+        '650': {'ind1': ' 012', 'ind2': '01234567', 'subfields': 'abcdegvxyz01234678'},
+        '700': {'ind1': '013', 'ind2': ' 2', 'subfields': 'abcdefghijklmnopqrstux0123456789'},
+        '856': {'ind1': ' 012347', 'ind2': ' 01278', 'subfields': 'abcdfhijklmnopqrstuvwxyz2368'},
+    },
+}
+
+RUSMARC_RULES = {
+    'leader': {
+        5: 'cdnop',
+        6: 'abcdefgijklmr',
+        7: 'acims',
+        8: ' 012',
+        10: '2',
+        11: '2',
+        17: ' 123',
+        18: ' in',
+        20: '4',
+        21: '5',
+        22: '0',
+    },
+    'mandatory': ['001', '100', '101', '200', '801'],
+    'fields': {
+        '001': {'repeatable': False},
+        '005': {'repeatable': False, 'fixed': {None: (16, {})}},
+        '010': {'ind1': ' ', 'ind2': ' ', 'subfields': 'abdz9'},
+        '100': {'repeatable': False, 'ind1': ' ', 'ind2': ' ', 'subfields': 'a',
+                'fixed': {'a': (36, {8: 'abcdefghijku'})}},
+        '101': {'repeatable': False, 'ind1': '012', 'ind2': ' ', 'subfields': 'abcdefghij'},
+        '102': {'repeatable': False, 'ind1': ' ', 'ind2': ' ', 'subfields': 'abc2'},
+        '105': {'repeatable': False, 'ind1': ' ', 'ind2': ' ', 'subfields': 'a',
+                'fixed': {'a': (13, {})}},
+        '106': {'repeatable': False, 'ind1': ' ', 'ind2': ' ', 'subfields': 'a'},
+        '200': {'repeatable': False, 'ind1': '01', 'ind2': ' ', 'subfields': 'abcdefghivz5'},
+        '205': {'ind1': ' ', 'ind2': ' ', 'subfields': 'abdfg'},
+        '210': {'ind1': ' 01', 'ind2': ' 1', 'subfields': 'abcdefgh'},
+        '215': {'ind1': ' ', 'ind2': ' ', 'subfields': 'acde'},
+        '225': {'ind1': '012', 'ind2': ' ', 'subfields': 'adefhiovxz'},
+        '300': {'ind1': ' ', 'ind2': ' ', 'subfields': 'a'},
+        '606': {'ind1': ' 012', 'ind2': ' ', 'subfields': 'abjxyz23'},
+        '700': {'repeatable': False, 'ind1': ' ', 'ind2': '01', 'subfields': 'abcdfgp34'},
+        '701': {'ind1': ' ', 'ind2': '01', 'subfields': 'abcdfgp34'},
+        '801': {'ind1': ' ', 'ind2': '0123', 'subfields': 'abcg2'},
+    },
+}
+
+
+class Violation(object):
+    def __init__(self, item, rule, tag=None, code=None, position=None, value=None):
+        """
+        item - record number
+        rule - leader, mandatory, repeatable, ind1, ind2, subfield,
+            fixed_length, fixed or structure
+        tag, code - field and subfield where the rule is broken
+        position - character position in the leader or a fixed field,
+            directory position for structure
+        value - the offending value or, for structure, the error from
+            iso2709.STRUCTURE_ERRORS
+        """
+        self.item = item
+        self.rule = rule
+        self.tag = tag
+        self.code = code
+        self.position = position
+        self.value = value
+
+    def to_dict(self):
+        return {
+            'item': self.item,
+            'rule': self.rule,
+            'tag': self.tag,
+            'code': self.code,
+            'position': self.position,
+            'value': self.value,
+        }
+
+    def __str__(self):
+        return '\t'.join('' if value is None else str(value) for value in
+                         (self.item, self.rule, self.tag, self.code, self.position, self.value))
+
+
+def _chars(value):
+    return frozenset(value) if value is not None else None
+
+
+class RuleSet(object):
+    def __init__(self, spec):
+        """
+        spec - rule set as described in the module docstring
+        """
+        self.leader = sorted((position, _chars(allowed)) for position, allowed in
+                             spec.get('leader', {}).iteritems())
+        self.mandatory = sorted(spec.get('mandatory', []))
+        self.non_repeatable = set()
+        # tag -> (ind1 characters or None, ind2 characters or None)
+        self.indicators = {}
+        # tag -> subfield codes
+        self.codes = {}
+        # tag -> {code: (length, [(position, characters)])}
+        self.fixed = {}
+
+        for tag, rule in spec.get('fields', {}).iteritems():
+            if not rule.get('repeatable', True):
+                self.non_repeatable.add(tag)
+            if 'ind1' in rule or 'ind2' in rule:
+                self.indicators[tag] = (_chars(rule.get('ind1')), _chars(rule.get('ind2')))
+            if 'subfields' in rule:
+                self.codes[tag] = _chars(rule['subfields'])
+            if 'fixed' in rule:
+                self.fixed[tag] = dict((code, (length, sorted((position, _chars(allowed)) for position, allowed
+                                                              in positions.iteritems())))
+                                       for code, (length, positions) in rule['fixed'].iteritems())
+
+    def _check_fixed(self, problems, tag, code, value, rule):
+        length, positions = rule
+        if length is not None and len(value) != length:
+            problems.append(('fixed_length', tag, code, None, len(value)))
+        for position, allowed in positions:
+            char = value[position:position + 1]
+            if char not in allowed:
+                problems.append(('fixed', tag, code, position, char))
+
+    def check(self, raw):
+        """
+        returns the problems of a raw record as a list of
+        (rule, tag, code, position, value)
+        """
+        problems = [('structure', None, None, position, error) for error, position in verify(raw)]
+        if any(problem[4] in DIRECTORY_ERRORS for problem in problems):
+            # the fields cannot be located
+            return problems
+
+        leader = raw[:LEADER_LEN]
+        for position, allowed in self.leader:
+            char = leader[position:position + 1]
+            if char not in allowed:
+                problems.append(('leader', None, None, position, char))
+
+        counts = {}
+        for tag, data in iter_fields(raw):
+            count = counts[tag] = counts.get(tag, 0) + 1
+            if count == 2 and tag in self.non_repeatable:
+                problems.append(('repeatable', tag, None, None, None))
+            fixed = self.fixed.get(tag)
+
+            if tag < '010' and tag.isdigit():
+                if fixed and None in fixed:
+                    self._check_fixed(problems, tag, None, data, fixed[None])
+                continue
+
+            indicators = self.indicators.get(tag)
+            if indicators is not None:
+                ind1, ind2 = indicators
+                if ind1 is not None and data[0:1] not in ind1:
+                    problems.append(('ind1', tag, None, None, data[0:1]))
+                if ind2 is not None and data[1:2] not in ind2:
+                    problems.append(('ind2', tag, None, None, data[1:2]))
+
+            codes = self.codes.get(tag)
+            if codes is not None or fixed:
+                for code, value in iter_subfields(data):
+                    if codes is not None and code not in codes:
+                        problems.append(('subfield', tag, code, None, None))
+                    if fixed and code in fixed:
+                        self._check_fixed(problems, tag, code, value, fixed[code])
+
+        for tag in self.mandatory:
+            if tag not in counts:
+                problems.append(('mandatory', tag, None, None, None))
+        return problems
+
+
+def _check_chunk(raws):
+    return [(i, problems) for i, problems in enumerate(workers.state.check(raw) for raw in raws) if problems]
+
+
+def validate_raws(raws, rules, processes=1, chunk_size=1000):
+    """
+    raws - iterable of raw records
+    rules - RuleSet
+    processes - worker processes, cpu count if None; 1 checks in process
+    yields Violation in record order
+    """
+    first = 0
+    for chunk, results in pool_map(_check_chunk, chunks(raws, chunk_size), processes, rules):
+        for i, problems in results:
+            for problem in problems:
+                yield Violation(first + i, *problem)
+        first += len(chunk)
+
+
+def validate(reader, rules, processes=1, chunk_size=1000):
+    """
+    validate_raws over the records of a Reader
+    """
+    return validate_raws(reader.iter_raw(), rules, processes, chunk_size)
+
+
+def write_report(violations, out):
+    """
+    writes violations as tab separated lines with a header; returns their
+    number
+    """
+    out.write('item\trule\ttag\tcode\tposition\tvalue\n')
+    count = 0
+    for violation in violations:
+        out.write('%s\n' % violation)
+        count += 1
+    return count
@@ -0,0 +1,89 @@
+# encoding: utf-8
+"""
+ordered maps over worker processes
+
+    for chunk, result in pool_map(convert_chunk, chunks(raws, 100), processes=4):
+        ...
+
+Tasks are submitted to a multiprocessing pool while at most max_pending of
+them are in flight, so a slow consumer does not pull the whole input into
+memory, and results come back in task order. Data every task needs (rule
+sets, shared memory batches, functions that cannot be pickled) is handed
+to the workers once as state when the pool starts; they inherit it instead
+of receiving it with every task.
+"""
+from collections import deque
+from multiprocessing import Pool, cpu_count
+
+# the worker_state given to start_pool, set in each worker by _init_worker
+state = None
+
+
+def _init_worker(value):
+    global state
+    state = value
+
+
+def chunks(items, chunk_size):
+    """
+    yields lists of up to chunk_size consecutive items
+    """
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def start_pool(processes=None, worker_state=None):
+    """
+    returns a Pool of processes (cpu count if None) whose workers see
+    worker_state as workers.state
+    """
+    return Pool(processes or cpu_count(), initializer=_init_worker, initargs=(worker_state, ))
+
+
+def ordered_map(pool, func, tasks, max_pending):
+    """
+    yields (task, func(task)) in task order; a task is only taken from
+    tasks while fewer than max_pending are submitted and not yet yielded
+    """
+    pending = deque()
+    for task in tasks:
+        pending.append((task, pool.apply_async(func, (task, ))))
+        if len(pending) >= max_pending:
+            task, result = pending.popleft()
+            yield task, result.get()
+    while pending:
+        task, result = pending.popleft()
+        yield task, result.get()
+
+
+def pool_map(func, tasks, processes=None, worker_state=None, max_pending=None):
+    """
+    ordered_map over a pool started for this call and closed after it
+    processes - worker processes, cpu count if None; 1 runs the tasks in
+        this process with workers.state set to worker_state
+    max_pending - tasks in flight, twice the processes if None
+    """
+    global state
+    processes = processes or cpu_count()
+    if processes == 1:
+        saved, state = state, worker_state
+        try:
+            for task in tasks:
+                yield task, func(task)
+        finally:
+            state = saved
+        return
+
+    pool = start_pool(processes, worker_state)
+    try:
+        for task, result in ordered_map(pool, func, tasks, max_pending or processes * 2):
+            yield task, result
+    finally:
+        pool.close()
+        pool.join()
@@ -0,0 +1,121 @@
+# encoding: utf-8
+import exc
+from iso2709 import _entry
+from record import Record
+from constants import LEADER_LEN, DIRECTORY_ENTRY_LEN, END_OF_FIELD, END_OF_RECORD
+
+
+class BatchEncoder(object):
+    """
+    serializes records one after another into a single growing bytearray
+
+    The leader and directory of each record are reserved up front and filled
+    in place once the field data is written, so no per-record directory,
+    field list or leader array is built. Unlike Record.as_marc the records
+    themselves are not modified.
+    """
+    def __init__(self, to_encoding='utf-8'):
+        self.to_encoding = to_encoding
+        self.utf8 = to_encoding.lower() in ('utf-8', 'utf8')
+        self.buffer = bytearray()
+        self.count = 0
+
+    def add(self, record):
+        """
+        raises FieldLengthInvalid if a field, its offset or the record does
+        not fit the fixed width numbers of ISO 2709, and
+        RecordDirectoryInvalid for a tag that is not 3 characters long; the
+        buffer is left as it was
+        """
+        buf = self.buffer
+        start = len(buf)
+        try:
+            self._add(record)
+        except exc.PymarcException:
+            del buf[start:]
+            raise
+        self.count += 1
+
+    def _add(self, record):
+        buf = self.buffer
+        fields = record.fields.ordered()
+        start = len(buf)
+        base_address = LEADER_LEN + len(fields) * DIRECTORY_ENTRY_LEN + 1
+
+        buf += record.leader.tostring()
+        buf += ' ' * (base_address - LEADER_LEN - 1)
+        buf += END_OF_FIELD
+
+        data_start = len(buf)
+        entry = start + LEADER_LEN
+        for field in fields:
+            field_start = len(buf)
+            buf += field.as_marc(self.to_encoding)
+            # _entry checks the widths, so the slice never resizes buf
+            buf[entry:entry + DIRECTORY_ENTRY_LEN] = _entry(
+                str(field.tag), len(buf) - field_start, field_start - data_start)
+            entry += DIRECTORY_ENTRY_LEN
+        buf += END_OF_RECORD
+
+        if len(buf) - start > 99999:
+            raise exc.FieldLengthInvalid
+        buf[start:start + 5] = '%05d' % (len(buf) - start)
+        buf[start + 12:start + 17] = '%05d' % base_address
+        if self.utf8:
+            buf[start + 9] = 'a'
+
+    def extend(self, records):
+        for record in records:
+            self.add(record)
+
+    def getvalue(self):
+        return str(self.buffer)
+
+    def clear(self):
+        del self.buffer[:]
+        self.count = 0
+
+
+def encode_records(records, to_encoding='utf-8'):
+    """
+    returns records serialized as one string of ISO 2709 records
+    """
+    encoder = BatchEncoder(to_encoding)
+    encoder.extend(records)
+    return encoder.getvalue()
+
+
+class Writer(object):
+    def __init__(self, file_handle, to_encoding='utf-8', batch_size=1000):
+        """
+        file_handle - binary file to write records to
+        to_encoding - encoding of written records
+        batch_size - records encoded into the buffer before it is written
+        """
+        self.file_handle = file_handle
+        self.batch_size = batch_size
+        self._encoder = BatchEncoder(to_encoding)
+
+    def write(self, record):
+        if self.file_handle is None:
+            raise exc.NoActiveFile
+        if not isinstance(record, Record):
+            raise exc.WriteNeedsRecord
+        self._encoder.add(record)
+        if self._encoder.count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if self._encoder.count:
+            self.file_handle.write(self._encoder.buffer)
+            self._encoder.clear()
+
+    def close(self):
+        """
+        writes buffered records and closes the file
+        """
+        if self.file_handle is None:
+            return
+        self.flush()
+        self.file_handle.close()
+        self.file_handle = None